@@ -0,0 +1,131 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from config import Config
+
+class SemanticAnswerCache:
+    """Answers keyed by (document namespace, question embedding).
+
+    A lookup returns the stored answer of the most similar earlier question
+    for the same document when cosine similarity reaches `threshold`.
+    Entries expire after `ttl_seconds`, and the least recently used entries
+    are evicted once `max_entries` is exceeded across all documents.
+    """
+
+    def __init__(self, threshold: float, ttl_seconds: float, max_entries: int):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.RLock()
+        # namespace -> entry_id -> (unit vector, question, answer, stored_at)
+        self._entries: Dict[str, Dict[int, Tuple[np.ndarray, str, str, float]]] = {}
+        # namespace -> (entry ids, stacked unit vectors), rebuilt lazily after changes
+        self._matrices: Dict[str, Tuple[List[int], np.ndarray]] = {}
+        self._lru: "OrderedDict[Tuple[str, int], None]" = OrderedDict()
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _unit(vector: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, namespace: str, entry_id: int):
+        entries = self._entries.get(namespace)
+        if entries is not None and entries.pop(entry_id, None) is not None:
+            self._matrices.pop(namespace, None)
+            if not entries:
+                del self._entries[namespace]
+        self._lru.pop((namespace, entry_id), None)
+
+    def _matrix(self, namespace: str) -> Tuple[List[int], np.ndarray]:
+        cached = self._matrices.get(namespace)
+        if cached is None:
+            entries = self._entries[namespace]
+            ids = list(entries)
+            cached = self._matrices[namespace] = (ids, np.stack([entries[i][0] for i in ids]))
+        return cached
+
+    def lookup(self, namespace: str, question_embedding: Sequence[float]) -> Optional[str]:
+        """Return a cached answer for a near-identical question, or None"""
+        if question_embedding is None:
+            return None
+        query = self._unit(question_embedding)
+        with self._lock:
+            if namespace not in self._entries:
+                self.misses += 1
+                return None
+            ids, matrix = self._matrix(namespace)
+            scores = matrix @ query
+            now = time.time()
+            for best in np.argsort(-scores):
+                if scores[best] < self.threshold:
+                    break
+                entry_id = ids[best]
+                _, _, answer, stored_at = self._entries[namespace][entry_id]
+                if now - stored_at > self.ttl_seconds:
+                    continue
+                self._lru.move_to_end((namespace, entry_id))
+                self.hits += 1
+                return answer
+            self._expire(namespace, now)
+            self.misses += 1
+            return None
+
+    def _expire(self, namespace: str, now: float):
+        for entry_id, (_, _, _, stored_at) in list(self._entries.get(namespace, {}).items()):
+            if now - stored_at > self.ttl_seconds:
+                self._remove(namespace, entry_id)
+                self.expirations += 1
+
+    def store(self, namespace: str, question: str, question_embedding: Sequence[float], answer: str):
+        if question_embedding is None:
+            return
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries.setdefault(namespace, {})[entry_id] = (
+                self._unit(question_embedding), question, answer, time.time()
+            )
+            self._matrices.pop(namespace, None)
+            self._lru[(namespace, entry_id)] = None
+            while len(self._lru) > self.max_entries:
+                (old_namespace, old_id), _ = self._lru.popitem(last=False)
+                self._remove(old_namespace, old_id)
+                self.evictions += 1
+
+    def invalidate(self, namespace: str):
+        """Drop every cached answer for a document (e.g. when it is re-ingested)"""
+        with self._lock:
+            for entry_id in list(self._entries.get(namespace, {})):
+                self._remove(namespace, entry_id)
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._lru),
+            "documents": len(self._entries),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+answer_cache = SemanticAnswerCache(
+    threshold=Config.ANSWER_CACHE_THRESHOLD,
+    ttl_seconds=Config.ANSWER_CACHE_TTL,
+    max_entries=Config.ANSWER_CACHE_MAX_ENTRIES,
+)
@@ -1,19 +1,118 @@
+import time
+import uuid
+
 from fastapi import FastAPI, Request, HTTPException
-from models import QARequest, QAResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Match
+from models import IngestJob, IngestRequest, QARequest, QAResponse, QAStreamEvent
 from rag_service import RAGService
 from config import Config
+from http_client import http_client
+from executors import executor_stats, run_io, shutdown_executors
+from loop_monitor import loop_monitor
+from metrics import REQUEST_DURATION, REQUESTS, REQUESTS_IN_FLIGHT, registry, request_id_var
+from cache import close_timing_log, embedding_cache
+from answer_cache import answer_cache
+from document_registry import document_registry
+from ingestion_jobs import JOB_PRIORITIES, IngestionScheduler, QueueFull
+from rate_limiter import UpstreamError, upstream_stats
 
 app = FastAPI(title="RAG API", description="Hackathon RAG Implementation for Fintech Company")
 rag_service = RAGService()
+ingestion_scheduler = IngestionScheduler(rag_service.ingest, Config.INGESTION_JOB_WORKERS, Config.INGESTION_JOB_QUEUE_SIZE)
+
+@app.on_event("startup")
+async def start_background_tasks():
+    loop_monitor.start()
+    ingestion_scheduler.start()
+    if Config.WORKERS > 1 and not (Config.DOCUMENT_REGISTRY_PATH and Config.EMBEDDING_CACHE_PATH):
+        print("Warning: with several workers and an in-memory document registry or embedding cache, "
+              "every worker ingests every document itself")
+
+@app.on_event("shutdown")
+async def release_resources():
+    """Release pooled upstream connections, executor threads and worker processes"""
+    loop_monitor.stop()
+    ingestion_scheduler.stop()
+    await http_client.aclose()
+    shutdown_executors()
+    close_timing_log()
+
+@app.middleware("http")
+async def track_requests(request: Request, call_next):
+    """Assign a request ID and record request counts, latency and in-flight gauges"""
+    # Label by route template (e.g. /hackrx/ingest/{job_id}) so stray paths and
+    # path parameters cannot blow up metric cardinality
+    route = next((r.path for r in app.routes if r.matches(request.scope)[0] == Match.FULL), "other")
+    request_id = request.headers.get("X-Request-ID") or str(uuid.uuid4())[:8]
+    request_id_var.set(request_id)
+    in_flight = REQUESTS_IN_FLIGHT.labels(route)
+    in_flight.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        in_flight.dec()
+        REQUESTS.labels(route, status).inc()
+        REQUEST_DURATION.labels(route).observe(time.perf_counter() - start)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+def _collect_component_stats():
+    """Cache, upstream, event-loop and executor state, read at scrape time"""
+    caches = {"embedding": embedding_cache.stats(), "answer": answer_cache.stats()}
+    yield ("rag_cache_hits_total", "counter", "Cache hits by cache",
+           [({"cache": name}, stats["hits"]) for name, stats in caches.items()])
+    yield ("rag_cache_misses_total", "counter", "Cache misses by cache",
+           [({"cache": name}, stats["misses"]) for name, stats in caches.items()])
+    yield ("rag_cache_hit_ratio", "gauge", "Cache hit ratio since start by cache",
+           [({"cache": name}, stats["hit_rate"]) for name, stats in caches.items()])
+    yield ("rag_embedding_cache_memory_bytes", "gauge", "Bytes held by the in-memory embedding cache tier",
+           [({}, caches["embedding"]["memory_bytes"])])
+
+    upstream = upstream_stats()
+    yield ("rag_upstream_rate_limit", "gauge", "Current adaptive request rate per provider (req/s)",
+           [({"provider": p}, s["rate_limiter"]["rate"]) for p, s in upstream.items()])
+    yield ("rag_upstream_queued", "gauge", "Calls waiting for a rate-limiter token per provider",
+           [({"provider": p}, s["rate_limiter"]["queued"]) for p, s in upstream.items()])
+    yield ("rag_upstream_throttled_total", "counter", "429 responses seen per provider",
+           [({"provider": p}, s["rate_limiter"]["throttled"]) for p, s in upstream.items()])
+    yield ("rag_upstream_circuit_open", "gauge", "1 while the provider's circuit breaker is not closed",
+           [({"provider": p}, float(s["circuit"]["state"] != "closed")) for p, s in upstream.items()])
+
+    loop = loop_monitor.stats()
+    yield ("rag_event_loop_lag_seconds", "gauge", "Event-loop lag over the recent probe window",
+           [({"quantile": q}, loop[f"{key}_lag_ms"] / 1000) for q, key in (("0.5", "p50"), ("0.99", "p99"), ("1", "max"))])
+    yield ("rag_event_loop_stalls_total", "counter", "Probes whose lag exceeded the warning threshold",
+           [({}, loop["stalls"])])
+
+    executors = executor_stats()
+    yield ("rag_executor_in_flight", "gauge", "Calls running or queued per executor pool",
+           [({"pool": name}, stats["in_flight"]) for name, stats in executors.items()])
+    yield ("rag_executor_workers", "gauge", "Configured workers per executor pool",
+           [({"pool": name}, stats["workers"]) for name, stats in executors.items()])
+
+registry.add_collector(_collect_component_stats)
+
+def verify_token(req: Request):
+    """Validate the bearer API token"""
+    token = req.headers.get("Authorization", "").replace("Bearer ", "")
+    if token != Config.API_KEY:
+        raise HTTPException(status_code=403, detail="Invalid API token")
+
+def upstream_unavailable(e: UpstreamError) -> HTTPException:
+    """Map an upstream provider failure to 503, passing on when to retry if known"""
+    headers = {"Retry-After": str(max(1, int(e.retry_after + 0.5)))} if e.retry_after else None
+    return HTTPException(status_code=503, detail=f"Upstream unavailable: {str(e)}", headers=headers)
 
 @app.post("/hackrx/run", response_model=QAResponse)
 async def handle_request(req: Request, body: QARequest):
     """Main endpoint for processing RAG requests"""
     try:
         # Validate API token
-        token = req.headers.get("Authorization", "").replace("Bearer ", "")
-        if token != Config.API_KEY:
-            raise HTTPException(status_code=403, detail="Invalid API token")
+        verify_token(req)
 
         # Process the request using RAG service
         answers, log_filepath = await rag_service.process_request(
@@ -27,6 +126,9 @@ async def handle_request(req: Request, body: QARequest):
     except HTTPException:
         # Re-raise HTTP exceptions as-is
         raise
+    except UpstreamError as e:
+        # Embedding or LLM provider failed, is throttling us or has its circuit open
+        raise upstream_unavailable(e)
     except ValueError as e:
         # Handle validation errors (like PDF processing issues)
         raise HTTPException(status_code=400, detail=f"Invalid request: {str(e)}")
@@ -37,11 +139,104 @@ async def handle_request(req: Request, body: QARequest):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+def format_stream_event(event: dict, stream_format: str) -> str:
+    payload = QAStreamEvent(**event).json(exclude_none=True)
+    if stream_format == "sse":
+        return f"event: {event['type']}\ndata: {payload}\n\n"
+    return payload + "\n"
+
+@app.post("/hackrx/run/stream")
+async def handle_stream_request(req: Request, body: QARequest, format: str = "ndjson", tokens: bool = False):
+    """Streaming variant of /hackrx/run: emits each answer as soon as it is ready.
+
+    `format` is "ndjson" (one JSON event per line) or "sse" (server-sent
+    events); `tokens=true` also streams LLM tokens tagged with the question index.
+    """
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'sse'")
+    try:
+        verify_token(req)
+
+        # Document ingestion happens before the response starts so its errors map to HTTP statuses
+        events = await rag_service.process_request_stream(
+            document_url=body.documents,
+            questions=body.questions,
+            stream_tokens=tokens
+        )
+    except HTTPException:
+        raise
+    except UpstreamError as e:
+        raise upstream_unavailable(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid request: {str(e)}")
+    except Exception as e:
+        print(f"Unexpected error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+    async def body_iterator():
+        async for event in events:
+            yield format_stream_event(event, format)
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(body_iterator(), media_type=media_type, headers={"Cache-Control": "no-cache"})
+
+@app.post("/hackrx/ingest", response_model=IngestJob, status_code=202)
+async def submit_ingestion(req: Request, body: IngestRequest):
+    """Queue a document for background ingestion and return its job.
+
+    A document that already has a queued or running job gets that job back;
+    /hackrx/run requests for it wait for the job instead of ingesting again.
+    """
+    verify_token(req)
+    if body.priority not in JOB_PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"priority must be one of {', '.join(JOB_PRIORITIES)}")
+    try:
+        job, _ = await ingestion_scheduler.submit(body.documents, body.priority)
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=f"Ingestion queue full: {str(e)}",
+                            headers={"Retry-After": str(Config.INGESTION_JOB_RESCAN_SECONDS)})
+    return job
+
+@app.get("/hackrx/ingest/{job_id}", response_model=IngestJob)
+async def ingestion_status(req: Request, job_id: str):
+    """Status and per-stage progress of an ingestion job"""
+    verify_token(req)
+    job = await ingestion_scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown ingestion job")
+    return job
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy"}
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss statistics for the embedding and answer caches, plus document registry counts"""
+    return {
+        "embedding_cache": embedding_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "document_registry": await run_io(document_registry.stats),
+    }
+
+@app.get("/upstream/stats")
+async def upstream_status():
+    """Adaptive rate limiter and circuit breaker state per upstream provider"""
+    return upstream_stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text-format metrics"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/runtime/stats")
+async def runtime_stats():
+    """Event-loop lag, executor pool utilisation and the ingestion job scheduler"""
+    return {"event_loop": loop_monitor.stats(), "executors": executor_stats(), "ingestion_jobs": ingestion_scheduler.stats()}
+
 @app.get("/")
 async def root():
     """Root endpoint with API information"""
@@ -49,7 +244,14 @@ async def root():
         "message": "RAG API for Hackathon",
         "endpoints": {
             "/hackrx/run": "POST - Main RAG processing endpoint",
+            "/hackrx/run/stream": "POST - Streaming answers (NDJSON or SSE, optional LLM tokens)",
+            "/hackrx/ingest": "POST - Queue background ingestion of a document, returns a job",
+            "/hackrx/ingest/{job_id}": "GET - Ingestion job status and per-stage progress",
             "/health": "GET - Health check",
+            "/metrics": "GET - Prometheus metrics (stage histograms, cache ratios, upstream errors, in-flight gauges)",
+            "/cache/stats": "GET - Cache hit/miss statistics",
+            "/upstream/stats": "GET - Upstream rate limiter and circuit breaker state",
+            "/runtime/stats": "GET - Event-loop lag and executor pool utilisation",
             "/docs": "GET - API documentation"
         }
     }
@@ -0,0 +1,72 @@
+import random
+import zlib
+from typing import List
+
+import numpy as np
+
+_VOCABULARY = (
+    "policy insured premium claim hospital treatment coverage benefit waiting period exclusion deductible "
+    "co-payment surgery maternity pre-existing disease room rent ambulance daycare procedure cashless network "
+    "reimbursement renewal grace sum assured cataract dental organ donor ayush domiciliary nominee portability "
+    "moratorium accident emergency diagnostic consultation pharmacy physiotherapy icu limit annual lifetime "
+    "floater dependent spouse child parent age proposal declaration document discharge summary invoice"
+).split()
+
+def document_pages(doc_id: str, num_pages: int, words_per_page: int = 450) -> List[str]:
+    """Deterministic pseudo-policy text for one document id"""
+    rng = random.Random(zlib.crc32(doc_id.encode()))
+    pages = []
+    for page_num in range(num_pages):
+        words = []
+        while len(words) < words_per_page:
+            clause = f"{page_num + 1}.{len(words) // 40 + 1}"
+            words.append(clause)
+            words.extend(rng.choice(_VOCABULARY) for _ in range(rng.randint(12, 30)))
+            words.append(f"Rs {rng.randint(1, 500) * 1000}.")
+        pages.append(" ".join(words))
+    return pages
+
+def document_questions(doc_id: str, count: int) -> List[str]:
+    rng = random.Random(zlib.crc32(f"questions:{doc_id}".encode()))
+    return [
+        f"What does the policy say about {rng.choice(_VOCABULARY)} and {rng.choice(_VOCABULARY)} "
+        f"under clause {rng.randint(1, 5)}.{rng.randint(1, 9)}?"
+        for _ in range(count)
+    ]
+
+def make_pdf(pages: List[str]) -> bytes:
+    """Build a minimal text-only PDF (one Helvetica content stream per page) readable by PyPDF2"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(len(pages)))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>")
+    font_id = 3 + 2 * len(pages)
+    for i, text in enumerate(pages):
+        lines = [text[j:j + 90] for j in range(0, len(text), 90)]
+        escaped = (line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in lines)
+        body = "BT /F1 9 Tf 20 820 Td 11 TL " + " ".join(f"({line}) '" for line in escaped) + " ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Contents {4 + 2 * i} 0 R "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> >>"
+        )
+        objects.append(f"<< /Length {len(body)} >>\nstream\n{body}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+def hashed_embedding(text: str, dimension: int) -> List[float]:
+    """Feature-hashed bag of words: cheap, deterministic and similar for overlapping texts"""
+    vector = np.zeros(dimension, dtype=np.float32)
+    for token in text.lower().split():
+        h = zlib.crc32(token.encode())
+        vector[h % dimension] += 1.0 if h & (1 << 31) else -1.0
+    norm = float(np.linalg.norm(vector))
+    return (vector / norm if norm else vector).tolist()
@@ -0,0 +1,293 @@
+"""Offline end-to-end benchmarks against local stand-ins for every upstream.
+
+Stub servers replace Gemini embeddings, OpenAI chat completions and the PDF
+host (with configurable latency, error and throttle rates); the in-process
+"local" vector backend replaces Pinecone. Scenarios:
+
+  cold        each request brings a new document (download, extract, chunk, embed, upsert, answer)
+  warm        repeated requests against one already-ingested document
+  concurrent  many clients posting to /hackrx/run at once over a small pool of documents
+
+Usage (from the repository root):
+
+  python -m benchmarks.run --scenarios cold,warm,concurrent --output results.json
+  python -m benchmarks.run --baseline benchmarks/results/previous.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from benchmarks.fixtures import document_questions
+from benchmarks.stubs import EndpointProfile, StubServer, StubSettings
+
+API_KEY = "benchmark-key"
+
+def summarize(samples: List[float]) -> Dict[str, Any]:
+    if not samples:
+        return {"count": 0}
+    values = np.asarray(samples, dtype=np.float64)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "count": int(values.size),
+        "mean": round(float(values.mean()), 4),
+        "p50": round(float(p50), 4),
+        "p95": round(float(p95), 4),
+        "p99": round(float(p99), 4),
+        "max": round(float(values.max()), 4),
+    }
+
+class StageRecorder:
+    """RAGService timing observer collecting every numeric stage timing of the current scenario"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+
+    def __call__(self, timing_data: Dict[str, Any]):
+        for stage, value in timing_data.get("timings", {}).items():
+            if isinstance(value, (int, float)):
+                self.samples.setdefault(stage, []).append(float(value))
+            elif isinstance(value, list):
+                self.samples.setdefault(stage, []).extend(float(v) for v in value if isinstance(v, (int, float)))
+
+    def reset(self):
+        self.samples = {}
+
+    def summary(self) -> Dict[str, Any]:
+        return {stage: summarize(values) for stage, values in sorted(self.samples.items())}
+
+def configure_environment(stub: StubServer, args: argparse.Namespace):
+    """Point every upstream at the stubs; must run before the application modules are imported"""
+    os.environ.update({
+        "GEMINI_BASE_URL": f"{stub.base_url}/v1beta",
+        "OPENAI_BASE_URL": f"{stub.base_url}/v1",
+        "GOOGLE_API_KEY": "benchmark",
+        "OPENAI_API_KEY": "benchmark",
+        "API_KEY": API_KEY,
+        "VECTOR_BACKEND": "local",
+        "EMBEDDING_CACHE_PATH": "",
+        "DOCUMENT_REGISTRY_PATH": "",
+        "TIMING_LOG_ENABLED": "false",
+        "QA_MODE": args.qa_mode,
+        "RERANKER": args.reranker,
+    })
+
+async def run_cold(service, stub: StubServer, args, run_id: str) -> Dict[str, Any]:
+    latencies, errors = [], 0
+    for i in range(args.cold_requests):
+        doc_id = f"cold-{run_id}-{i}"
+        start = time.perf_counter()
+        try:
+            await service.process_request(stub.document_url(doc_id), document_questions(doc_id, args.questions))
+        except Exception as e:
+            errors += 1
+            print(f"cold request failed: {e}")
+        latencies.append(time.perf_counter() - start)
+    return {"requests": args.cold_requests, "errors": errors, "latencies": latencies}
+
+async def prepare_warm(service, stub: StubServer, args, run_id: str):
+    """Ingest the warm scenario's document; not measured, the ingesting request belongs to the cold scenario"""
+    doc_id = f"warm-{run_id}"
+    await service.process_request(stub.document_url(doc_id), document_questions(doc_id, args.questions))
+
+async def run_warm(service, stub: StubServer, args, run_id: str) -> Dict[str, Any]:
+    doc_id = f"warm-{run_id}"
+    url = stub.document_url(doc_id)
+    latencies, errors = [], 0
+    for i in range(args.warm_requests):
+        questions = document_questions(f"{doc_id}-{i}", args.questions)
+        start = time.perf_counter()
+        try:
+            await service.process_request(url, questions)
+        except Exception as e:
+            errors += 1
+            print(f"warm request failed: {e}")
+        latencies.append(time.perf_counter() - start)
+    return {"requests": args.warm_requests, "errors": errors, "latencies": latencies}
+
+async def run_concurrent(app, stub: StubServer, args, run_id: str) -> Dict[str, Any]:
+    import httpx
+
+    latencies: List[float] = []
+    errors = 0
+    next_request = 0
+
+    async def client_loop(client: httpx.AsyncClient):
+        nonlocal errors, next_request
+        while next_request < args.concurrent_requests:
+            n = next_request
+            next_request += 1
+            doc_id = f"concurrent-{run_id}-{n % args.documents}"
+            body = {
+                "documents": stub.document_url(doc_id),
+                "questions": document_questions(f"{doc_id}-{n}", args.questions),
+            }
+            start = time.perf_counter()
+            response = await client.post("/hackrx/run", json=body, headers={"Authorization": f"Bearer {API_KEY}"})
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+                print(f"concurrent request failed: {response.status_code} {response.text[:200]}")
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        await asyncio.gather(*[client_loop(client) for _ in range(args.concurrency)])
+    return {"requests": args.concurrent_requests, "errors": errors, "latencies": latencies}
+
+async def run_scenarios(args: argparse.Namespace, stub: StubServer) -> Dict[str, Any]:
+    # Application modules read their configuration at import time
+    import api
+    from config import Config
+    from loop_monitor import loop_monitor
+    from rate_limiter import upstream_stats
+
+    Config.ANSWER_CACHE_ENABLED = args.answer_cache
+    service = api.rag_service
+    recorder = StageRecorder()
+    service.timing_observers.append(recorder)
+    loop_monitor.start()
+
+    run_id = datetime.now().strftime("%H%M%S")
+    results: Dict[str, Any] = {}
+    for scenario in args.scenarios:
+        if scenario == "warm":
+            await prepare_warm(service, stub, args, run_id)
+        recorder.reset()
+        counters_before = stub.counters
+        wall_start = time.perf_counter()
+        if scenario == "cold":
+            outcome = await run_cold(service, stub, args, run_id)
+        elif scenario == "warm":
+            outcome = await run_warm(service, stub, args, run_id)
+        elif scenario == "concurrent":
+            outcome = await run_concurrent(api.app, stub, args, run_id)
+        else:
+            raise ValueError(f"Unknown scenario '{scenario}'")
+        wall_time = time.perf_counter() - wall_start
+        counters_after = stub.counters
+
+        completed = outcome["requests"] - outcome["errors"]
+        results[scenario] = {
+            "requests": outcome["requests"],
+            "errors": outcome["errors"],
+            "wall_time": round(wall_time, 4),
+            "throughput_rps": round(completed / wall_time, 4) if wall_time else None,
+            "questions_per_second": round(completed * args.questions / wall_time, 4) if wall_time else None,
+            "latency": summarize(outcome["latencies"]),
+            "stages": recorder.summary(),
+            "upstream_calls": {name: counters_after[name] - counters_before[name] for name in counters_after},
+        }
+        latency = results[scenario]["latency"]
+        print(f"{scenario:>10}: {outcome['requests']} requests, {outcome['errors']} errors, "
+              f"p50 {latency.get('p50', 0):.3f}s p95 {latency.get('p95', 0):.3f}s p99 {latency.get('p99', 0):.3f}s, "
+              f"{results[scenario]['throughput_rps']} req/s")
+
+    loop_monitor.stop()
+    await api.http_client.aclose()
+    return {"scenarios": results, "event_loop": loop_monitor.stats(), "upstream": upstream_stats()}
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]):
+    """Print latency and throughput changes per scenario relative to a previous results file"""
+    print("\nChange vs baseline (positive = slower / more throughput):")
+    for scenario, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if not previous:
+            continue
+        parts = []
+        for key in ("p50", "p95", "p99"):
+            old, new = previous["latency"].get(key), current["latency"].get(key)
+            if old:
+                parts.append(f"{key} {100 * (new - old) / old:+.1f}%")
+        old_rps, new_rps = previous.get("throughput_rps"), current.get("throughput_rps")
+        if old_rps:
+            parts.append(f"throughput {100 * (new_rps - old_rps) / old_rps:+.1f}%")
+        print(f"{scenario:>10}: " + ", ".join(parts))
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default="cold,warm,concurrent", type=lambda s: s.split(","))
+    parser.add_argument("--output", help="Results JSON path (default: benchmarks/results/benchmark_<timestamp>.json)")
+    parser.add_argument("--baseline", help="Previous results JSON to compare against")
+    parser.add_argument("--pages", type=int, default=20, help="Pages per stub PDF")
+    parser.add_argument("--questions", type=int, default=5, help="Questions per request")
+    parser.add_argument("--cold-requests", type=int, default=5)
+    parser.add_argument("--warm-requests", type=int, default=20)
+    parser.add_argument("--concurrent-requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients")
+    parser.add_argument("--documents", type=int, default=4, help="Distinct documents in the concurrent scenario")
+    parser.add_argument("--embed-latency-ms", type=float, default=40)
+    parser.add_argument("--chat-latency-ms", type=float, default=400)
+    parser.add_argument("--pdf-latency-ms", type=float, default=80)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of embedding/chat calls answered with 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of embedding/chat calls answered with 429")
+    parser.add_argument("--qa-mode", default="per_question", choices=["per_question", "batched", "packed"])
+    parser.add_argument("--reranker", default="none", choices=["none", "lexical", "onnx"])
+    parser.add_argument("--answer-cache", action="store_true", help="Keep the semantic answer cache on")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    def profile(latency_ms: float, failures: bool) -> EndpointProfile:
+        return EndpointProfile(
+            latency_ms=latency_ms, jitter=args.jitter,
+            error_rate=args.error_rate if failures else 0.0,
+            throttle_rate=args.throttle_rate if failures else 0.0,
+        )
+
+    settings = StubSettings(
+        embed=profile(args.embed_latency_ms, True),
+        chat=profile(args.chat_latency_ms, True),
+        pdf=profile(args.pdf_latency_ms, False),
+        pages=args.pages,
+    )
+    stub = StubServer(settings)
+    stub.start()
+    configure_environment(stub, args)
+    try:
+        outcome = asyncio.run(run_scenarios(args, stub))
+    finally:
+        stub.stop()
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        **outcome,
+    }
+
+    output = args.output or os.path.join(
+        "benchmarks", "results", f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import random
+import re
+import socket
+import threading
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from benchmarks.fixtures import document_pages, hashed_embedding, make_pdf
+
+@dataclass
+class EndpointProfile:
+    """Latency and failure behaviour of one stub endpoint"""
+    latency_ms: float = 0.0
+    jitter: float = 0.2  # Latency is drawn uniformly from latency * (1 +/- jitter)
+    error_rate: float = 0.0  # Share of requests answered with 503
+    throttle_rate: float = 0.0  # Share of requests answered with 429 + Retry-After
+    retry_after: float = 0.2
+
+    async def delay(self):
+        if self.latency_ms > 0:
+            spread = self.jitter * self.latency_ms
+            await asyncio.sleep(max(0.0, random.uniform(self.latency_ms - spread, self.latency_ms + spread)) / 1000)
+
+    def failure(self) -> Optional[Response]:
+        roll = random.random()
+        if roll < self.error_rate:
+            return JSONResponse({"error": {"message": "stub unavailable"}}, status_code=503)
+        if roll < self.error_rate + self.throttle_rate:
+            return JSONResponse({"error": {"message": "stub rate limit"}}, status_code=429,
+                                headers={"Retry-After": str(self.retry_after)})
+        return None
+
+@dataclass
+class StubSettings:
+    embed: EndpointProfile = field(default_factory=lambda: EndpointProfile(latency_ms=40))
+    chat: EndpointProfile = field(default_factory=lambda: EndpointProfile(latency_ms=400))
+    pdf: EndpointProfile = field(default_factory=lambda: EndpointProfile(latency_ms=80))
+    pages: int = 20
+    dimension: int = 768
+    chat_tokens_per_second: float = 200.0  # Pace of streamed completion tokens
+
+@lru_cache(maxsize=64)
+def _document_pdf(doc_id: str, pages: int) -> bytes:
+    return make_pdf(document_pages(doc_id, pages))
+
+_PACKED_COUNT_RE = re.compile(r"containing exactly (\d+) answer strings")
+
+def create_stub_app(settings: StubSettings) -> FastAPI:
+    """One app standing in for Gemini embeddings, OpenAI chat completions and the PDF host"""
+    app = FastAPI()
+    counters: Dict[str, int] = {"embed": 0, "batch_embed": 0, "chat": 0, "pdf": 0}
+    app.state.counters = counters
+
+    @app.post("/v1beta/models/embedding-001:embedContent")
+    async def embed_content(request: Request):
+        counters["embed"] += 1
+        await settings.embed.delay()
+        failure = settings.embed.failure()
+        if failure is not None:
+            return failure
+        body = await request.json()
+        text = body["content"]["parts"][0]["text"]
+        return {"embedding": {"values": hashed_embedding(text, settings.dimension)}}
+
+    @app.post("/v1beta/models/embedding-001:batchEmbedContents")
+    async def batch_embed_contents(request: Request):
+        counters["batch_embed"] += 1
+        await settings.embed.delay()
+        failure = settings.embed.failure()
+        if failure is not None:
+            return failure
+        body = await request.json()
+        return {"embeddings": [
+            {"values": hashed_embedding(item["content"]["parts"][0]["text"], settings.dimension)}
+            for item in body["requests"]
+        ]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        counters["chat"] += 1
+        body = await request.json()
+        failure = settings.chat.failure()
+        if failure is not None:
+            await settings.chat.delay()
+            return failure
+        prompt = body["messages"][0]["content"]
+        match = _PACKED_COUNT_RE.search(prompt)
+        if match:
+            content = json.dumps({"answers": [f"Stub answer {i + 1}." for i in range(int(match.group(1)))]})
+        else:
+            content = "Stub answer: the policy covers this subject subject to the stated limits and waiting periods."
+        usage = {"prompt_tokens": len(prompt.split()), "completion_tokens": len(content.split())}
+
+        if not body.get("stream"):
+            await settings.chat.delay()
+            return {"choices": [{"message": {"role": "assistant", "content": content}}], "usage": usage}
+
+        async def events():
+            await settings.chat.delay()  # Time to first token
+            for word in content.split(" "):
+                chunk = {"choices": [{"delta": {"content": word + " "}}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(1 / settings.chat_tokens_per_second)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/documents/{doc_id}.pdf")
+    async def document(doc_id: str):
+        counters["pdf"] += 1
+        await settings.pdf.delay()
+        failure = settings.pdf.failure()
+        if failure is not None:
+            return failure
+        return Response(_document_pdf(doc_id, settings.pages), media_type="application/pdf")
+
+    return app
+
+class StubServer:
+    """Runs the stub app with uvicorn on a background thread (its own event loop)"""
+
+    def __init__(self, settings: StubSettings, host: str = "127.0.0.1", port: int = 0):
+        self.settings = settings
+        self.host = host
+        self.port = port or self._free_port(host)
+        self.app = create_stub_app(settings)
+        self._server = uvicorn.Server(uvicorn.Config(self.app, host=self.host, port=self.port, log_level="warning"))
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _free_port(host: str) -> int:
+        with socket.socket() as sock:
+            sock.bind((host, 0))
+            return sock.getsockname()[1]
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def counters(self) -> Dict[str, int]:
+        return dict(self.app.state.counters)
+
+    def document_url(self, doc_id: str) -> str:
+        return f"{self.base_url}/documents/{doc_id}.pdf"
+
+    def start(self, timeout: float = 10.0):
+        self._thread = threading.Thread(target=self._server.run, name="benchmark-stubs", daemon=True)
+        self._thread.start()
+        deadline = time.time() + timeout
+        while not self._server.started:
+            if time.time() > deadline:
+                raise RuntimeError("Stub server did not start")
+            time.sleep(0.05)
+
+    def stop(self):
+        self._server.should_exit = True
+        if self._thread is not None:
+            self._thread.join(timeout=5)
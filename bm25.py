@@ -0,0 +1,141 @@
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r"\d[\d,]*(?:\.\d+)*|[a-z]+(?:['\-][a-z]+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with "
+    "what which who whom how when where does do did under any".split()
+)
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase terms; keeps clause numbers ("4.2.1") and amounts ("1,00,000" -> "100000") intact"""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token[0].isdigit():
+            token = token.replace(",", "").rstrip(".")
+        if token and token not in _STOPWORDS:
+            tokens.append(token)
+    return tokens
+
+class BM25Index:
+    """Okapi BM25 over one document's chunks with CSR-style array-backed postings.
+
+    For term id t, postings live in doc_ids[offsets[t]:offsets[t + 1]] (chunk
+    ordinals, int32) with matching term frequencies in tfs (uint16), so the
+    whole index is a handful of contiguous arrays plus the vocabulary dict.
+
+    Chunks with identical text share one vector in the vector store (see
+    vector_store.make_vector_id), labelled with the first occurrence's
+    ordinal; `first_ordinals` maps every ordinal to that first occurrence,
+    and search returns only first occurrences, so both rankings agree.
+    """
+
+    def __init__(self, vocab: Dict[str, int], offsets: np.ndarray, doc_ids: np.ndarray, tfs: np.ndarray,
+                 doc_lens: np.ndarray, texts: List[str], starts: np.ndarray, ends: np.ndarray,
+                 first_ordinals: np.ndarray, k1: float = 1.2, b: float = 0.75):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lens = doc_lens
+        self.texts = texts
+        self.starts = starts  # Chunk char offsets in the document, -1 when unknown
+        self.ends = ends
+        self.first_ordinals = first_ordinals
+        self.k1 = k1
+        self.b = b
+        num_docs = len(doc_lens)
+        doc_freqs = np.diff(offsets).astype(np.float32)
+        self.idf = np.log(1.0 + (num_docs - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+        avg_len = float(doc_lens.mean()) if num_docs else 0.0
+        # Per-chunk length normalisation term, precomputed once
+        self._norm = (k1 * (1 - b + b * doc_lens / avg_len)).astype(np.float32) if avg_len else np.full(num_docs, k1, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.doc_lens)
+
+    def chunk_metadata(self, ordinal: int) -> Dict[str, Any]:
+        """Metadata for a sparse-only hit, shaped like the vector-store metadata"""
+        metadata = {"text": self.texts[ordinal], "ordinal": ordinal}
+        if self.starts[ordinal] >= 0:
+            metadata["start"] = int(self.starts[ordinal])
+            metadata["end"] = int(self.ends[ordinal])
+        return metadata
+
+    def search(self, query: str, top_k: int = 10) -> List[Tuple[int, float]]:
+        """Return [(chunk ordinal, score)] for the best-matching chunks"""
+        scores = np.zeros(len(self.doc_lens), dtype=np.float32)
+        matched = False
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end].astype(np.float32)
+            scores[docs] += self.idf[term_id] * tf * (self.k1 + 1) / (tf + self._norm[docs])
+            matched = True
+        if not matched:
+            return []
+        hits = np.flatnonzero(scores)
+        # A repeated text scores exactly like its first occurrence
+        hits = hits[self.first_ordinals[hits] == hits]
+        k = min(top_k, hits.size)
+        top = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ordinal), float(scores[ordinal])) for ordinal in top]
+
+class BM25Builder:
+    """Collects chunks during ingestion (in any order) and compacts them into a BM25Index"""
+
+    def __init__(self):
+        self._chunks: Dict[int, Tuple[str, Dict[str, int], int, int]] = {}
+
+    def add(self, ordinal: int, text: str, start: int = -1, end: int = -1):
+        counts: Dict[str, int] = {}
+        for token in tokenize(text):
+            counts[token] = counts.get(token, 0) + 1
+        self._chunks[ordinal] = (text, counts, start, end)
+
+    def build(self, k1: float = 1.2, b: float = 0.75) -> BM25Index:
+        num_docs = max(self._chunks) + 1 if self._chunks else 0
+        texts = [""] * num_docs
+        doc_lens = np.zeros(num_docs, dtype=np.float32)
+        starts = np.full(num_docs, -1, dtype=np.int64)
+        ends = np.full(num_docs, -1, dtype=np.int64)
+        first_ordinals = np.arange(num_docs, dtype=np.int32)
+        first_by_text: Dict[str, int] = {}
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        for ordinal in sorted(self._chunks):
+            text, counts, starts[ordinal], ends[ordinal] = self._chunks[ordinal]
+            texts[ordinal] = text
+            first_ordinals[ordinal] = first_by_text.setdefault(text, ordinal)
+            doc_lens[ordinal] = sum(counts.values())
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((ordinal, tf))
+
+        vocab = {term: term_id for term_id, term in enumerate(postings)}
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[term]) for term in vocab])
+        doc_ids = np.empty(offsets[-1], dtype=np.int32)
+        tfs = np.empty(offsets[-1], dtype=np.uint16)
+        for term, term_id in vocab.items():
+            start = offsets[term_id]
+            entries = postings[term]
+            doc_ids[start:start + len(entries)] = [ordinal for ordinal, _ in entries]
+            tfs[start:start + len(entries)] = [min(tf, 65535) for _, tf in entries]
+        return BM25Index(vocab, offsets, doc_ids, tfs, doc_lens, texts, starts, ends, first_ordinals, k1, b)
+
+# --- Per-document registry ---
+_sparse_indexes: Dict[str, BM25Index] = {}
+_lock = threading.Lock()
+
+def set_sparse_index(namespace: str, index: BM25Index):
+    with _lock:
+        _sparse_indexes[namespace] = index
+
+def get_sparse_index(namespace: str) -> Optional[BM25Index]:
+    return _sparse_indexes.get(namespace)
@@ -1,50 +1,205 @@
 import os
 import json
+import queue
+import random
+import logging
+import sqlite3
 import hashlib
-from datetime import datetime
-from typing import Dict, Any
+import threading
+from collections import OrderedDict
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, Any, Iterable, List, Optional, Sequence, Tuple
+
+from config import Config
+from vectors import CompactVector, Vector, compact, decode, encode, expand
 
 # --- Caching ---
-embedding_cache = {}
-document_cache = {}  # Cache for processed documents
+class EmbeddingCache:
+    """Two-tier embedding cache: a byte-bounded in-memory LRU of compact vectors
+    in front of a SQLite store that survives restarts and is shared between
+    worker processes (WAL mode allows concurrent readers and one writer).
+
+    Vectors are kept as float32 arrays, or with `dtype="int8"` as
+    scalar-quantized codes plus a scale; lookups always return float32.
+    """
+
+    def __init__(self, max_bytes: int, db_path: Optional[str] = None, dtype: str = "float32"):
+        self.max_bytes = max_bytes
+        self.db_path = db_path
+        self.dtype = dtype
+        self._memory: "OrderedDict[str, CompactVector]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        if not self.db_path:
+            return None
+        if self._conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vector BLOB NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _remember(self, key: str, vector: CompactVector):
+        """Insert into the memory tier and evict least-recently-used entries over budget"""
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= previous.nbytes
+        self._memory[key] = vector
+        self._memory_bytes += vector.nbytes
+        while self._memory_bytes > self.max_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, Vector]:
+        """Look up many keys, memory first, then one batched disk query"""
+        found: Dict[str, Vector] = {}
+        with self._lock:
+            pending = []
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = expand(vector)
+                    self.hits += 1
+                else:
+                    pending.append(key)
+
+            db = self._db()
+            if pending and db is not None:
+                unique = list(dict.fromkeys(pending))
+                for i in range(0, len(unique), 500):
+                    part = unique[i:i + 500]
+                    rows = db.execute(
+                        f"SELECT key, dim, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})",
+                        part,
+                    ).fetchall()
+                    for key, dim, blob in rows:
+                        vector = decode(blob, dim)
+                        found[key] = expand(vector)
+                        self._remember(key, vector)
+                disk_found = [key for key in pending if key in found]
+                self.disk_hits += len(disk_found)
+                pending = [key for key in pending if key not in found]
+
+            self.misses += len(pending)
+        return found
+
+    def get(self, key: str) -> Optional[Vector]:
+        return self.get_many([key]).get(key)
+
+    def set_many(self, items: Iterable[Tuple[str, Vector]]):
+        """Store many embeddings in memory and persist them in one transaction"""
+        rows = []
+        with self._lock:
+            for key, values in items:
+                vector = compact(values, self.dtype)
+                self._remember(key, vector)
+                rows.append((key, len(values), encode(vector)))
+            db = self._db()
+            if rows and db is not None:
+                with db:
+                    db.executemany("INSERT OR REPLACE INTO embeddings (key, dim, vector) VALUES (?, ?, ?)", rows)
+
+    def set(self, key: str, values: Vector):
+        self.set_many([(key, values)])
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def __getitem__(self, key: str) -> Vector:
+        vector = self.get(key)
+        if vector is None:
+            raise KeyError(key)
+        return vector
+
+    def __setitem__(self, key: str, values: Vector):
+        self.set(key, values)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "dtype": self.dtype,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+embedding_cache = EmbeddingCache(
+    Config.EMBEDDING_CACHE_MAX_BYTES, Config.EMBEDDING_CACHE_PATH, Config.EMBEDDING_CACHE_DTYPE
+)
 
 def get_cache_key(text: str) -> str:
     """Generate a cache key for text"""
     return hashlib.md5(text.encode()).hexdigest()
 
-def get_document_key(url: str) -> str:
-    """Generate a cache key for document URL"""
-    return hashlib.md5(url.encode()).hexdigest()
-
-def is_document_processed(doc_url: str) -> bool:
-    """Check if document was already processed"""
-    doc_key = get_document_key(doc_url)
-    return doc_key in document_cache
-
-def mark_document_processed(doc_url: str, chunks_count: int):
-    """Mark document as processed"""
-    doc_key = get_document_key(doc_url)
-    document_cache[doc_key] = {
-        "url": doc_url,
-        "processed_at": datetime.now().isoformat(),
-        "chunks_count": chunks_count
-    }
-    print(f"Document cached: {chunks_count} chunks from {doc_url[:50]}...")
-
-def save_timing_logs(request_id: str, timing_data: Dict[str, Any]) -> str:
-    """Save timing logs to a file with unique ID"""
-    # Create logs directory if it doesn't exist
-    logs_dir = "timing_logs"
-    os.makedirs(logs_dir, exist_ok=True)
-    
-    # Create filename with timestamp and request ID
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"timing_log_{timestamp}_{request_id}.json"
-    filepath = os.path.join(logs_dir, filename)
-    
-    # Save to file
-    with open(filepath, 'w') as f:
-        json.dump(timing_data, f, indent=2)
-    
-    print(f"Timing logs saved to: {filepath}")
-    return filepath
+# --- Timing log sink ---
+_timing_logger: Optional[logging.Logger] = None
+_timing_listener: Optional[QueueListener] = None
+_timing_lock = threading.Lock()
+
+def _get_timing_logger() -> logging.Logger:
+    """Logger whose records are queued and written by a listener thread to a rotating file"""
+    global _timing_logger, _timing_listener
+    with _timing_lock:
+        if _timing_logger is None:
+            directory = os.path.dirname(Config.TIMING_LOG_PATH)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            handler = RotatingFileHandler(
+                Config.TIMING_LOG_PATH, maxBytes=Config.TIMING_LOG_MAX_BYTES,
+                backupCount=Config.TIMING_LOG_BACKUPS, encoding="utf-8", delay=True,
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            log_queue: "queue.SimpleQueue" = queue.SimpleQueue()
+            _timing_listener = QueueListener(log_queue, handler)
+            _timing_listener.start()
+            logger = logging.getLogger("rag.timing")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(QueueHandler(log_queue))
+            _timing_logger = logger
+        return _timing_logger
+
+def save_timing_logs(request_id: str, timing_data: Dict[str, Any]) -> Optional[str]:
+    """Queue the request's timing data as one JSON line, if timing logs are enabled and sampled.
+
+    Only the enqueue happens on the caller's thread; returns the log path,
+    or None when nothing was logged.
+    """
+    if not Config.TIMING_LOG_ENABLED or random.random() >= Config.TIMING_LOG_SAMPLE_RATE:
+        return None
+    _get_timing_logger().info(json.dumps(timing_data, default=str))
+    return Config.TIMING_LOG_PATH
+
+def close_timing_log():
+    """Flush queued timing records and stop the writer thread"""
+    global _timing_logger, _timing_listener
+    with _timing_lock:
+        if _timing_listener is not None:
+            _timing_listener.stop()
+            _timing_listener = None
+        if _timing_logger is not None:
+            for handler in list(_timing_logger.handlers):
+                _timing_logger.removeHandler(handler)
+            _timing_logger = None
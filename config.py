@@ -11,22 +11,136 @@ class Config:
     API_KEY = os.getenv("API_KEY")
     INDEX_NAME = "hackrx-docs"
     
+    # Worker processes (uvicorn --workers, see Procfile). Workers share the document registry and
+    # the embedding cache through the SQLite stores under cache/; per-process pools and upstream
+    # rate limits below are divided between them.
+    WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+    INGESTION_LEASE_SECONDS = 60  # A worker ingesting a document renews its lease; others wait for it or take over on expiry
+    INGESTION_LEASE_POLL_SECONDS = 0.5
+
+    # Background ingestion jobs (POST /hackrx/ingest), per worker process
+    INGESTION_JOB_WORKERS = int(os.getenv("INGESTION_JOB_WORKERS", "2"))  # Documents ingested concurrently
+    INGESTION_JOB_QUEUE_SIZE = 100  # Queued jobs beyond this are rejected with 503
+    INGESTION_JOB_PROGRESS_SECONDS = 1.0  # How often a running job's progress (and heartbeat) is saved
+    INGESTION_JOB_RESCAN_SECONDS = 30  # How often jobs of dead workers (stale heartbeat) are picked up
+    
     # Embedding settings
-    BATCH_SIZE = 20
+    BATCH_SIZE = 100  # Texts per batchEmbedContents request (API maximum is 100)
+    EMBED_USE_BATCH_API = True
+    EMBED_CONCURRENT_BATCHES = 4  # Concurrent batchEmbedContents requests
+    EMBED_CONCURRENT_SINGLE = 8  # Concurrent single-item retries for failed batch items
+    EMBEDDING_CACHE_MAX_BYTES = 64 * 1024 * 1024  # In-memory LRU budget (float32 vectors)
+    EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "cache/embeddings.sqlite3")  # "" disables the disk tier
+    EMBEDDING_CACHE_DTYPE = os.getenv("EMBEDDING_CACHE_DTYPE", "float32")  # "int8" stores scalar-quantized vectors (4x smaller)
+    DOCUMENT_REGISTRY_PATH = os.getenv("DOCUMENT_REGISTRY_PATH", "cache/documents.sqlite3")  # "" keeps the registry in memory
+    DOCUMENT_REVALIDATE_SECONDS = 300  # Reuse a URL's registered document this long before a conditional re-download
     CHUNK_SIZE = 300
     CHUNK_OVERLAP = 50
+    CHUNK_BOUNDARY = os.getenv("CHUNK_BOUNDARY", "token")  # "token", "sentence", "heading" or "page" (best for incremental updates)
+    STREAMING_INGESTION = True  # Overlap extraction, chunking, embedding and upsert
+    INCREMENTAL_INGESTION = os.getenv("INCREMENTAL_INGESTION", "true").lower() == "true"  # Update a changed document in place, touching only changed chunks
+    PIPELINE_QUEUE_SIZE = 4  # Chunk batches buffered between pipeline stages
+    
+    # PDF extraction settings
+    PDF_EXTRACT_PROCESSES = int(os.getenv("PDF_EXTRACT_PROCESSES", max(1, (os.cpu_count() or 1) // WORKERS)))  # 1 = extract in-process
+    PDF_PARALLEL_MIN_PAGES = 32  # Smaller documents are not worth the process hand-off
+    PDF_PAGES_PER_TASK = 16
     
     # Pinecone settings
     PINECONE_DIMENSION = 768
     PINECONE_CLOUD = 'aws'
     PINECONE_REGION = 'us-east-1'
+    PINECONE_ENSURE_INDEX = os.getenv("PINECONE_ENSURE_INDEX", "true").lower() == "true"  # false skips list/create on first use
     UPSERT_BATCH_SIZE = 50
+    DELETE_BATCH_SIZE = 1000  # Pinecone accepts up to 1000 ids per delete
     CONCURRENT_UPLOADS = 3
     
+    # Vector store backend: "pinecone" or "local" (in-process NumPy index)
+    VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")
+    LOCAL_EXACT_MAX_VECTORS = 20000  # Brute-force search up to this size, IVF above it
+    LOCAL_IVF_NLIST = 0  # 0 = sqrt(num_vectors)
+    LOCAL_IVF_NPROBE = 8
+    
     # Search settings
     TOP_K = 10
+    HYBRID_RETRIEVAL = True  # Fuse dense results with a per-document BM25 index
+    HYBRID_CANDIDATES = 30  # Dense and sparse candidates fetched before fusion
+    RRF_K = 60  # Reciprocal rank fusion constant
+
+    # Rerank stage between retrieval and prompt construction: "none", "lexical" (CPU, no extra deps)
+    # or "onnx" (cross-encoder; needs onnxruntime + tokenizers and the model files below)
+    RERANKER = os.getenv("RERANKER", "none").lower()
+    RERANK_CANDIDATES = 30  # Chunks retrieved per question before reranking
+    RERANK_TOP_N = 10  # Chunks kept per question after reranking
+    RERANK_BATCH_SIZE = 32  # (question, chunk) pairs per cross-encoder forward pass
+    RERANK_THREADS = int(os.getenv("RERANK_THREADS", "2"))
+    RERANK_MODEL_PATH = os.getenv("RERANK_MODEL_PATH", "models/reranker.onnx")
+    RERANK_TOKENIZER_PATH = os.getenv("RERANK_TOKENIZER_PATH", "models/tokenizer.json")
+    RERANK_MAX_LENGTH = 256
+    
+    # Context assembly: overlapping hits are merged, near-duplicates dropped, then packed to a budget
+    CONTEXT_TOKEN_BUDGET = 2000
+    CONTEXT_DEDUP_THRESHOLD = 0.8  # Share of a span's shingles already in a better span that marks it a duplicate
+    
+    # Question answering mode: "per_question" (one embed/retrieve/LLM call each),
+    # "batched" (one embedding batch and one multi-query retrieval for all questions)
+    # or "packed" (batched, plus questions sharing context answered in one LLM call)
+    QA_MODE = os.getenv("QA_MODE", "per_question")
+    PACK_MAX_QUESTIONS = 5
+    PACK_MIN_OVERLAP = 0.3  # Jaccard overlap of retrieved chunks needed to share a call
+    PACK_CONTEXT_TOKEN_BUDGET = 4000
+    
+    # Semantic answer cache (per document, keyed by question embedding)
+    ANSWER_CACHE_ENABLED = True
+    ANSWER_CACHE_THRESHOLD = 0.97  # Minimum cosine similarity to reuse an answer
+    ANSWER_CACHE_TTL = 3600  # Seconds
+    ANSWER_CACHE_MAX_ENTRIES = 5000
     
     # GPT settings
     GPT_MODEL = "gpt-4o-mini"
     GPT_TEMPERATURE = 0.0
     GPT_MAX_TOKENS = 300
+    
+    # HTTP client settings (shared keep-alive pools for Gemini, OpenAI and PDF hosts)
+    HTTP2 = True  # Used when the optional h2 package is installed
+    HTTP_TIMEOUT = 30
+    HTTP_MAX_CONNECTIONS = 100
+    HTTP_MAX_KEEPALIVE = 20
+    HTTP_KEEPALIVE_EXPIRY = 30
+    HTTP_DEFAULT_HOST_CONCURRENCY = 16
+    HTTP_HOST_CONCURRENCY = {
+        "generativelanguage.googleapis.com": 16,
+        "api.openai.com": 16,
+    }
+    
+    # Upstream API endpoints (override to point at local stub servers)
+    GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta")
+    OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+    
+    # Adaptive per-provider rate limiting: token buckets that halve their rate on 429s
+    # (pausing for Retry-After) and creep back up on successes
+    UPSTREAM_RATE_LIMITS = {  # Requests per second each provider starts at and recovers to, per worker
+        "gemini": float(os.getenv("GEMINI_RATE_LIMIT", "25")) / WORKERS,
+        "openai": float(os.getenv("OPENAI_RATE_LIMIT", "10")) / WORKERS,
+    }
+    UPSTREAM_MIN_RATE = 0.5
+    UPSTREAM_BURST_SECONDS = 1.0  # Bucket capacity, in seconds' worth of the current rate
+    
+    # Circuit breaker: after this many consecutive 5xx/transport failures calls fail fast
+    CIRCUIT_FAILURE_THRESHOLD = 5
+    CIRCUIT_RESET_TIMEOUT = 30.0  # Seconds before a half-open trial call is let through
+    
+    # Executors for blocking work (nothing blocking runs on the event loop)
+    IO_THREADS = int(os.getenv("IO_THREADS", "32"))  # Vector store calls, SQLite, log files
+    CPU_THREADS = int(os.getenv("CPU_THREADS", min(8, max(1, (os.cpu_count() or 1) // WORKERS))))  # Chunking, BM25, NumPy, reranking
+    LOOP_LAG_INTERVAL = 0.25  # Seconds between event-loop lag probes
+    LOOP_LAG_WARN_SECONDS = 0.1  # Lag above this is logged as a stall
+    
+    # Observability: /metrics is always on; spans need opentelemetry-api (and an SDK/exporter configured)
+    OTEL_TRACING = os.getenv("OTEL_TRACING", "false").lower() == "true"
+    # Per-request timing logs: opt-in, sampled, one JSON line per request, rotated, written off-thread
+    TIMING_LOG_ENABLED = os.getenv("TIMING_LOG_ENABLED", "false").lower() == "true"
+    TIMING_LOG_PATH = os.getenv("TIMING_LOG_PATH", "timing_logs/timing.jsonl")
+    TIMING_LOG_SAMPLE_RATE = float(os.getenv("TIMING_LOG_SAMPLE_RATE", "1.0"))
+    TIMING_LOG_MAX_BYTES = 10 * 1024 * 1024
+    TIMING_LOG_BACKUPS = 5
@@ -0,0 +1,120 @@
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence
+
+from config import Config
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+_APPROX_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_WORD_RE = re.compile(r"\w+")
+
+@lru_cache(maxsize=1)
+def _encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(Config.GPT_MODEL)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+def count_tokens(text: str) -> int:
+    """Token count with tiktoken when installed, else a word/punctuation approximation"""
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(_APPROX_TOKEN_RE.findall(text))
+
+def _truncate_to_budget(text: str, budget: int) -> str:
+    """Cut text to roughly `budget` tokens on a word boundary"""
+    tokens = count_tokens(text)
+    if tokens <= budget:
+        return text
+    cut = int(len(text) * budget / tokens)
+    space = text.rfind(" ", 0, cut)
+    return text[:space if space > 0 else cut]
+
+def _shingles(text: str, size: int = 5) -> set:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def merge_spans(chunks: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Merge chunks that overlap or touch in the document back into contiguous spans.
+
+    Each chunk is a metadata dict with "text" and, when known, "start"/"end"
+    char offsets. Chunks are slices of the same document text, so the union
+    of two overlapping chunks is the first chunk plus the tail of the second.
+    Each span keeps the best (lowest) retrieval rank of its members.
+    """
+    located, spans = [], []
+    for rank, chunk in enumerate(chunks):
+        start, end = chunk.get("start"), chunk.get("end")
+        if start is None or end is None or start < 0:
+            spans.append({"text": chunk["text"], "start": None, "end": None, "rank": rank})
+        else:
+            located.append({"text": chunk["text"], "start": int(start), "end": int(end), "rank": rank})
+
+    located.sort(key=lambda span: span["start"])
+    current = None
+    for span in located:
+        if current is not None and span["start"] <= current["end"]:
+            if span["end"] > current["end"]:
+                current["text"] += span["text"][current["end"] - span["start"]:]
+                current["end"] = span["end"]
+            current["rank"] = min(current["rank"], span["rank"])
+        else:
+            if current is not None:
+                spans.append(current)
+            current = dict(span)
+    if current is not None:
+        spans.append(current)
+    return spans
+
+def assemble_context(chunks: Sequence[Dict[str, Any]], budget_tokens: Optional[int] = None,
+                     dedup_threshold: Optional[float] = None) -> List[str]:
+    """Turn ranked retrieval hits into context passages that fit a token budget.
+
+    Overlapping hits are merged into spans, spans whose word 5-gram shingles
+    are mostly (>= dedup_threshold) contained in a better-ranked span are dropped,
+    and spans are packed best-rank-first until the budget is used. The
+    chosen spans are returned in document order so the same hits always
+    produce the same prompt text.
+    """
+    if budget_tokens is None:
+        budget_tokens = Config.CONTEXT_TOKEN_BUDGET
+    if dedup_threshold is None:
+        dedup_threshold = Config.CONTEXT_DEDUP_THRESHOLD
+
+    kept, kept_shingles = [], []
+    for span in sorted(merge_spans(chunks), key=lambda span: span["rank"]):
+        shingles = _shingles(span["text"])
+        # Containment rather than Jaccard, so a span mostly repeated inside a longer one is dropped too
+        duplicate = any(
+            len(shingles & other) / len(shingles) >= dedup_threshold
+            for other in kept_shingles
+        )
+        if not duplicate:
+            kept.append(span)
+            kept_shingles.append(shingles)
+
+    packed, used = [], 0
+    for span in kept:
+        remaining = budget_tokens - used
+        if remaining <= 0:
+            break
+        tokens = count_tokens(span["text"])
+        if tokens > remaining:
+            if packed:
+                continue  # A later, shorter span may still fit
+            span = dict(span, text=_truncate_to_budget(span["text"], remaining))
+            tokens = remaining
+        packed.append(span)
+        used += tokens
+
+    packed.sort(key=lambda span: (span["start"] is None, span["start"] or 0, span["rank"]))
+    return [span["text"] for span in packed]
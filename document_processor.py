@@ -1,7 +1,18 @@
-import requests
-import PyPDF2
 import io
-from typing import List
+import os
+import re
+import mmap
+import asyncio
+import tempfile
+from typing import AsyncIterator, Iterable, Iterator, List, NamedTuple, Optional
+
+import httpx
+import numpy as np
+import PyPDF2
+from config import Config
+from executors import run_cpu, run_io, run_pdf
+from http_client import http_client
+from metrics import timed_stage
 
 def convert_google_docs_url(url: str) -> str:
     """Convert Google Docs URL to PDF export URL"""
@@ -21,16 +32,42 @@ def convert_google_docs_url(url: str) -> str:
                 return f"https://docs.google.com/document/d/{doc_id}/export?format=pdf"
     return url
 
-def extract_text_from_pdf(url: str) -> List[str]:
-    """Extract text from PDF URL using PyPDF2"""
+class FetchedPDF(NamedTuple):
+    content: Optional[bytes]  # None when the server answered 304 Not Modified
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+    @property
+    def not_modified(self) -> bool:
+        return self.content is None
+
+@timed_stage("download")
+async def fetch_pdf_async(url: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> FetchedPDF:
+    """Download PDF bytes, as a conditional GET when validators from an earlier download are given"""
     # Convert Google Docs URL to PDF export URL if needed
     pdf_url = convert_google_docs_url(url)
-    
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
     try:
-        response = requests.get(pdf_url, timeout=30)
+        response = await http_client.get(pdf_url, headers=headers)
+        if response.status_code == 304 and headers:
+            return FetchedPDF(None, etag, last_modified)
         response.raise_for_status()  # Raise an exception for bad status codes
-        
-        pdf_bytes = response.content
+        return FetchedPDF(response.content, response.headers.get("etag"), response.headers.get("last-modified"))
+    except httpx.HTTPError as e:
+        raise ValueError(f"Failed to download PDF from URL: {e}")
+
+async def download_pdf_async(url: str) -> bytes:
+    """Download PDF bytes over the shared async HTTP client"""
+    return (await fetch_pdf_async(url)).content
+
+def extract_pages_from_bytes(pdf_bytes: bytes) -> List[str]:
+    """Extract text from PDF bytes using PyPDF2"""
+    try:
         pdf_file = io.BytesIO(pdf_bytes)
         
         # Use PyPDF2 to extract text
@@ -46,11 +83,80 @@ def extract_text_from_pdf(url: str) -> List[str]:
             raise ValueError("No text content found in the PDF")
             
         return pages
-    except requests.exceptions.RequestException as e:
-        raise ValueError(f"Failed to download PDF from URL: {e}")
     except Exception as e:
         raise ValueError(f"Failed to extract text from PDF: {e}")
 
+# --- Parallel extraction ---
+def _write_file(fd: int, data: bytes):
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+
+def _extract_page_range(pdf_path: str, start: int, end: int) -> List[str]:
+    """Worker entry point: memory-map the shared temp file and extract pages [start, end)"""
+    with open(pdf_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        reader = PyPDF2.PdfReader(mapped)
+        return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+async def iter_pdf_pages(pdf_bytes: bytes) -> AsyncIterator[str]:
+    """Yield page texts in order, extracting off the event loop.
+
+    Large documents are split into page ranges across the PDF process pool.
+    The bytes are written once to a temp file that each worker memory-maps,
+    instead of being pickled into every task.
+    """
+    try:
+        reader = await run_cpu(PyPDF2.PdfReader, io.BytesIO(pdf_bytes))
+        num_pages = len(reader.pages)
+    except Exception as e:
+        raise ValueError(f"Failed to extract text from PDF: {e}")
+
+    if Config.PDF_EXTRACT_PROCESSES > 1 and num_pages >= Config.PDF_PARALLEL_MIN_PAGES:
+        fd, pdf_path = tempfile.mkstemp(suffix=".pdf")
+        futures = []
+        try:
+            await run_io(_write_file, fd, pdf_bytes)
+            step = Config.PDF_PAGES_PER_TASK
+            futures = [
+                asyncio.ensure_future(run_pdf(_extract_page_range, pdf_path, start, min(start + step, num_pages)))
+                for start in range(0, num_pages, step)
+            ]
+            # Awaiting in submission order preserves page order while later ranges keep running
+            for start, future in zip(range(0, num_pages, step), futures):
+                try:
+                    page_texts = await future
+                except Exception as e:
+                    raise ValueError(f"Failed to extract text from PDF pages {start + 1}-{start + step}: {e}")
+                for text in page_texts:
+                    yield text
+        finally:
+            for future in futures:
+                future.cancel()
+            await run_io(os.unlink, pdf_path)
+        return
+
+    for page_num in range(num_pages):
+        page = reader.pages[page_num]
+        try:
+            text = await run_cpu(page.extract_text)
+        except Exception as e:
+            raise ValueError(f"Failed to extract text from PDF page {page_num + 1}: {e}")
+        yield text or ""
+
+async def extract_pages_async(pdf_bytes: bytes) -> List[str]:
+    """Extract the text of downloaded PDF bytes without blocking the event loop"""
+    pages = [text async for text in iter_pdf_pages(pdf_bytes)]
+    if not pages or all(not page.strip() for page in pages):
+        raise ValueError("No text content found in the PDF")
+    return pages
+
+async def extract_text_from_pdf_async(url: str) -> List[str]:
+    """Download a PDF and extract its text without blocking the event loop"""
+    return await extract_pages_async(await download_pdf_async(url))
+
+def extract_text_from_pdf(url: str) -> List[str]:
+    """Synchronous wrapper for PDF download and extraction"""
+    return asyncio.run(extract_text_from_pdf_async(url))
+
 def chunk_text(pages: List[str], chunk_size: int = 300, overlap: int = 50) -> List[str]:
     """Chunk text with overlap"""
     all_text = "\n".join(pages)
@@ -61,3 +167,142 @@ def chunk_text(pages: List[str], chunk_size: int = 300, overlap: int = 50) -> Li
         if len(chunk.strip()) > 0:  # Only add non-empty chunks
             chunks.append(chunk)
     return chunks
+
+# --- Offset-tracking chunker ---
+_TOKEN_RE = re.compile(r"\S+")
+_SENTENCE_END_RE = re.compile(r"[.!?;:][\"')\]]*$")
+_HEADING_RE = re.compile(r"^(?:\d+(?:\.\d+)*\.?|[IVXLC]+\.|[A-Z][A-Z0-9&/\-]{2,}|Section|SECTION|Article|ARTICLE|Clause|CLAUSE|Chapter|CHAPTER)$")
+
+class Chunk(NamedTuple):
+    text: str  # Slice of the page-joined document text
+    start: int  # Char offset of the chunk in the document text
+    end: int
+    page: int  # 1-based page the chunk starts on
+    page_end: int  # 1-based page the chunk ends on
+
+class Chunker:
+    """Incremental overlapping-window chunker that returns slices of the original text.
+
+    Token boundaries are computed once per page with a regex scan; windows
+    are cut from those offsets, so overlapping tokens are never copied or
+    re-joined. `boundary` can be "token" (fixed windows), "sentence" (end
+    windows after sentence punctuation when possible), "heading" (prefer
+    ending right before a heading-like line, then sentences) or "page"
+    (sentence windows that never cross a page break, so an edit leaves the
+    chunks of all other pages unchanged). Pages are fed one at a time; only
+    the unconsumed tail of the text is kept in memory.
+    """
+
+    def __init__(self, chunk_size: int = 300, overlap: int = 50, boundary: str = "token"):
+        if overlap >= chunk_size:
+            raise ValueError("overlap must be smaller than chunk_size")
+        if boundary not in ("token", "sentence", "heading", "page"):
+            raise ValueError(f"Unknown chunk boundary '{boundary}'")
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.boundary = boundary
+        self._text = ""  # Unconsumed tail of the document text
+        self._base = 0  # Document offset of self._text[0]
+        self._length = 0  # Document text length so far
+        self._pages = 0
+        self._starts = np.zeros(0, dtype=np.int64)
+        self._ends = np.zeros(0, dtype=np.int64)
+        self._token_pages = np.zeros(0, dtype=np.int32)
+        self._breaks = np.zeros(0, dtype=bool)  # _breaks[j]: a chunk may end right before token j
+        self._headings = np.zeros(0, dtype=bool)
+
+    def feed(self, page_text: str) -> List[Chunk]:
+        """Add the next page and return the chunks that are now complete"""
+        # Page-aligned windows: the previous page's tokens are all emitted before this page starts
+        done = list(self._emit(final=True)) if self.boundary == "page" else []
+        separator = "\n" if self._pages else ""
+        page_offset = self._length + len(separator)
+        self._pages += 1
+        self._text += separator + page_text
+        self._length = page_offset + len(page_text)
+
+        matches = list(_TOKEN_RE.finditer(page_text))
+        if matches:
+            starts = np.fromiter((m.start() for m in matches), dtype=np.int64, count=len(matches)) + page_offset
+            ends = np.fromiter((m.end() for m in matches), dtype=np.int64, count=len(matches)) + page_offset
+            breaks = np.zeros(len(matches), dtype=bool)
+            headings = np.zeros(len(matches), dtype=bool)
+            if self.boundary != "token":
+                # A sentence-ending token allows a break before the following token
+                previous_end = bool(len(self._breaks)) and _SENTENCE_END_RE.search(self._token_text(len(self._starts) - 1)) is not None
+                sentence_end = [_SENTENCE_END_RE.search(m.group()) is not None for m in matches]
+                breaks[0] = previous_end
+                breaks[1:] = sentence_end[:-1]
+                if self.boundary == "heading":
+                    for j, m in enumerate(matches):
+                        line_start = m.start() == 0 or page_text[m.start() - 1] == "\n"
+                        headings[j] = line_start and _HEADING_RE.match(m.group()) is not None
+            self._starts = np.concatenate([self._starts, starts])
+            self._ends = np.concatenate([self._ends, ends])
+            self._token_pages = np.concatenate([self._token_pages, np.full(len(matches), self._pages, dtype=np.int32)])
+            self._breaks = np.concatenate([self._breaks, breaks])
+            self._headings = np.concatenate([self._headings, headings])
+
+        return done + list(self._emit(final=False))
+
+    def flush(self) -> List[Chunk]:
+        """Return the remaining chunks once all pages have been fed"""
+        return list(self._emit(final=True))
+
+    def _token_text(self, j: int) -> str:
+        return self._text[self._starts[j] - self._base:self._ends[j] - self._base]
+
+    def _window_end(self, i: int, n: int) -> int:
+        """Exclusive token index where the window starting at token i ends"""
+        hard_end = i + self.chunk_size
+        if hard_end >= n or self.boundary == "token":
+            return min(hard_end, n)
+        lo = i + max(self.overlap + 1, self.chunk_size // 2)
+        if self.boundary == "heading":
+            candidates = np.flatnonzero(self._headings[lo:hard_end + 1])
+            if candidates.size:
+                return lo + int(candidates[-1])
+        candidates = np.flatnonzero(self._breaks[lo:hard_end + 1])
+        if candidates.size:
+            return lo + int(candidates[-1])
+        return hard_end
+
+    def _emit(self, final: bool) -> Iterator[Chunk]:
+        n = len(self._starts)
+        i = 0
+        # Without `final`, a window is only cut once a token past it has arrived
+        while i < n and (final or i + self.chunk_size < n):
+            end = self._window_end(i, n)
+            start_char = int(self._starts[i])
+            end_char = int(self._ends[end - 1])
+            yield Chunk(
+                text=self._text[start_char - self._base:end_char - self._base],
+                start=start_char,
+                end=end_char,
+                page=int(self._token_pages[i]),
+                page_end=int(self._token_pages[end - 1]),
+            )
+            if end >= n:
+                i = n
+                break
+            i = max(i + 1, end - self.overlap)
+
+        # Drop consumed tokens and text
+        if i:
+            keep_from_char = int(self._starts[i]) if i < n else self._length
+            self._text = self._text[keep_from_char - self._base:]
+            self._base = keep_from_char
+            self._starts = self._starts[i:]
+            self._ends = self._ends[i:]
+            self._token_pages = self._token_pages[i:]
+            self._breaks = self._breaks[i:]
+            self._headings = self._headings[i:]
+
+def chunk_document(pages: Iterable[str], chunk_size: int = 300, overlap: int = 50, boundary: str = "token") -> List[Chunk]:
+    """Chunk pages into overlapping windows with page numbers and char offsets"""
+    chunker = Chunker(chunk_size, overlap, boundary)
+    chunks = []
+    for page in pages:
+        chunks.extend(chunker.feed(page))
+    chunks.extend(chunker.flush())
+    return chunks
@@ -0,0 +1,367 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import uuid
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from config import Config
+from cache import get_cache_key
+from document_processor import Chunk
+
+def content_hash(data: bytes) -> str:
+    """Identity of a document: SHA-256 of its bytes (and its default vector-store namespace)"""
+    return hashlib.sha256(data).hexdigest()[:32]
+
+class DocumentRegistry:
+    """Persistent, content-addressed record of ingested documents.
+
+    `urls` maps each source URL to the content hash last seen there plus its
+    HTTP validators (ETag / Last-Modified) for conditional re-downloads.
+    `documents` holds one row per distinct PDF (by content hash) with its
+    namespace and ingestion status, and `chunks` its chunk texts, offsets
+    and the embedding-cache key of each chunk's vector. Signed URLs that
+    differ only in their query string therefore resolve to one document,
+    and a changed PDF at a known URL gets a new hash and is re-ingested
+    (incrementally, into the earlier version's namespace, when enabled).
+    `leases` and `jobs` coordinate ingestion between worker processes and
+    hold the background ingestion queue (see ingestion_jobs).
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.db_path:
+                directory = os.path.dirname(self.db_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+            else:
+                conn = sqlite3.connect(":memory:", check_same_thread=False)
+            conn.executescript(
+                "CREATE TABLE IF NOT EXISTS urls ("
+                "url TEXT PRIMARY KEY, content_hash TEXT NOT NULL, etag TEXT, last_modified TEXT, "
+                "checked_at REAL NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "content_hash TEXT PRIMARY KEY, namespace TEXT NOT NULL, size INTEGER NOT NULL, "
+                "status TEXT NOT NULL, num_pages INTEGER, num_chunks INTEGER, updated_at TEXT NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "content_hash TEXT NOT NULL, ordinal INTEGER NOT NULL, text TEXT NOT NULL, "
+                "start INTEGER NOT NULL, end INTEGER NOT NULL, page INTEGER NOT NULL, page_end INTEGER NOT NULL, "
+                "embedding_key TEXT, PRIMARY KEY (content_hash, ordinal));"
+                "CREATE TABLE IF NOT EXISTS leases ("
+                "key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, url TEXT NOT NULL, priority INTEGER NOT NULL, status TEXT NOT NULL, "
+                "owner TEXT, heartbeat REAL, progress TEXT, result TEXT, error TEXT, "
+                "created_at REAL NOT NULL, started_at REAL, finished_at REAL);"
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, priority, created_at);"
+                # At most one queued or running job per URL, across worker processes
+                "CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_url ON jobs (url) WHERE status IN ('queued', 'running');"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    # --- URLs ---
+    def lookup_url(self, url: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db().execute(
+                "SELECT content_hash, etag, last_modified, checked_at FROM urls WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"content_hash": row[0], "etag": row[1], "last_modified": row[2], "checked_at": row[3]}
+
+    def record_url(self, url: str, content_hash: str, etag: Optional[str] = None,
+                   last_modified: Optional[str] = None):
+        with self._lock:
+            conn = self._db()
+            conn.execute(
+                "INSERT OR REPLACE INTO urls (url, content_hash, etag, last_modified, checked_at) VALUES (?, ?, ?, ?, ?)",
+                (url, content_hash, etag, last_modified, time.time()),
+            )
+            conn.commit()
+
+    def touch_url(self, url: str):
+        """The URL was revalidated (304 Not Modified)"""
+        with self._lock:
+            conn = self._db()
+            conn.execute("UPDATE urls SET checked_at = ? WHERE url = ?", (time.time(), url))
+            conn.commit()
+
+    # --- Documents ---
+    def get_document(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db().execute(
+                "SELECT namespace, size, status, num_pages, num_chunks, updated_at FROM documents WHERE content_hash = ?",
+                (content_hash,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "content_hash": content_hash, "namespace": row[0], "size": row[1], "status": row[2],
+            "num_pages": row[3], "num_chunks": row[4], "updated_at": row[5],
+        }
+
+    def begin_document(self, content_hash: str, namespace: str, size: int, resume: bool = False):
+        """Register a document as being ingested.
+
+        Chunks of an earlier interrupted attempt are dropped unless `resume`
+        is set, in which case they are the checkpoint the new attempt
+        continues from (see get_checkpoint).
+        """
+        with self._lock:
+            conn = self._db()
+            if not resume:
+                conn.execute("DELETE FROM chunks WHERE content_hash = ?", (content_hash,))
+            conn.execute(
+                "INSERT OR REPLACE INTO documents (content_hash, namespace, size, status, updated_at) "
+                "VALUES (?, ?, ?, 'ingesting', ?)",
+                (content_hash, namespace, size, datetime.now().isoformat()),
+            )
+            conn.commit()
+
+    def namespace_in_use(self, namespace: str, content_hash: str) -> bool:
+        """Whether another live document (e.g. an incrementally updated one) owns `namespace`"""
+        with self._lock:
+            row = self._db().execute(
+                "SELECT 1 FROM documents WHERE namespace = ? AND content_hash != ? AND status != 'superseded' LIMIT 1",
+                (namespace, content_hash),
+            ).fetchone()
+        return row is not None
+
+    def add_chunks(self, content_hash: str, start_ordinal: int, chunks: Sequence[Chunk], embedded: Sequence[bool]):
+        """Store one batch of chunks; chunks whose vector was not stored get no embedding reference"""
+        rows = [
+            (content_hash, ordinal, chunk.text, chunk.start, chunk.end, chunk.page, chunk.page_end,
+             get_cache_key(chunk.text) if has_vector else None)
+            for ordinal, (chunk, has_vector) in enumerate(zip(chunks, embedded), start=start_ordinal)
+        ]
+        with self._lock:
+            conn = self._db()
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunks (content_hash, ordinal, text, start, end, page, page_end, embedding_key) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.commit()
+
+    def truncate_chunks(self, content_hash: str, num_chunks: int):
+        """Drop chunk rows past the end of the document (left by an attempt that chunked differently)"""
+        with self._lock:
+            conn = self._db()
+            conn.execute("DELETE FROM chunks WHERE content_hash = ? AND ordinal >= ?", (content_hash, num_chunks))
+            conn.commit()
+
+    def mark_ready(self, content_hash: str, num_pages: Optional[int], num_chunks: int,
+                   supersedes: Optional[str] = None):
+        """Make the document available for reuse.
+
+        With `supersedes`, the earlier version whose namespace this document
+        updated is retired in the same transaction, so the namespace always
+        has exactly one live owner.
+        """
+        with self._lock:
+            conn = self._db()
+            now = datetime.now().isoformat()
+            conn.execute(
+                "UPDATE documents SET status = 'ready', num_pages = ?, num_chunks = ?, updated_at = ? WHERE content_hash = ?",
+                (num_pages, num_chunks, now, content_hash),
+            )
+            if supersedes is not None:
+                conn.execute(
+                    "UPDATE documents SET status = 'superseded', updated_at = ? WHERE content_hash = ?",
+                    (now, supersedes),
+                )
+            conn.commit()
+        print(f"Document registered: {num_chunks} chunks, content hash {content_hash}")
+
+    def get_checkpoint(self, content_hash: str, namespace: str) -> Dict[int, Tuple[str, bool]]:
+        """Batches an interrupted ingestion of the document into `namespace` already stored.
+
+        Maps ordinal -> (chunk text, whether its vector was stored); empty
+        unless the document is still registered as 'ingesting' there.
+        """
+        with self._lock:
+            conn = self._db()
+            row = conn.execute(
+                "SELECT 1 FROM documents WHERE content_hash = ? AND namespace = ? AND status = 'ingesting'",
+                (content_hash, namespace),
+            ).fetchone()
+            if row is None:
+                return {}
+            rows = conn.execute(
+                "SELECT ordinal, text, embedding_key IS NOT NULL FROM chunks WHERE content_hash = ?", (content_hash,)
+            ).fetchall()
+        return {ordinal: (text, bool(embedded)) for ordinal, text, embedded in rows}
+
+    def get_chunks(self, content_hash: str) -> List[Chunk]:
+        """Chunks of a document in ordinal order"""
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT text, start, end, page, page_end FROM chunks WHERE content_hash = ? ORDER BY ordinal",
+                (content_hash,),
+            ).fetchall()
+        return [Chunk(*row) for row in rows]
+
+    def get_chunk_records(self, content_hash: str) -> List[Tuple[Chunk, Optional[str]]]:
+        """(chunk, embedding key or None) pairs of a document in ordinal order"""
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT text, start, end, page, page_end, embedding_key FROM chunks WHERE content_hash = ? ORDER BY ordinal",
+                (content_hash,),
+            ).fetchall()
+        return [(Chunk(*row[:5]), row[5]) for row in rows]
+
+    def get_embedding_keys(self, content_hash: str) -> Set[str]:
+        """Embedding references of the document's chunks that have a stored vector"""
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT embedding_key FROM chunks WHERE content_hash = ? AND embedding_key IS NOT NULL",
+                (content_hash,),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    # --- Leases ---
+    def acquire_lease(self, key: str, owner: str, ttl: float) -> bool:
+        """Take (or extend) the lease on `key` unless another owner holds an unexpired one"""
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            conn.execute(
+                "INSERT INTO leases (key, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE leases.expires_at < ? OR leases.owner = excluded.owner",
+                (key, owner, now + ttl, now),
+            )
+            conn.commit()
+            row = conn.execute("SELECT owner FROM leases WHERE key = ?", (key,)).fetchone()
+        return row is not None and row[0] == owner
+
+    def renew_lease(self, key: str, owner: str, ttl: float) -> bool:
+        with self._lock:
+            conn = self._db()
+            updated = conn.execute(
+                "UPDATE leases SET expires_at = ? WHERE key = ? AND owner = ?", (time.time() + ttl, key, owner)
+            ).rowcount
+            conn.commit()
+        return updated == 1
+
+    def release_lease(self, key: str, owner: str):
+        with self._lock:
+            conn = self._db()
+            conn.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner))
+            conn.commit()
+
+    # --- Ingestion jobs ---
+    _JOB_COLUMNS = "id, url, priority, status, owner, heartbeat, progress, result, error, created_at, started_at, finished_at"
+
+    @staticmethod
+    def _job_row(row: Tuple) -> Dict[str, Any]:
+        job = dict(zip(DocumentRegistry._JOB_COLUMNS.split(", "), row))
+        for field in ("progress", "result"):
+            job[field] = json.loads(job[field]) if job[field] else None
+        return job
+
+    def create_job(self, job_id: str, url: str, priority: int) -> Tuple[Dict[str, Any], bool]:
+        """Queue a job for `url`. Returns (job, created); an active job for the URL is returned instead"""
+        with self._lock:
+            conn = self._db()
+            try:
+                conn.execute(
+                    "INSERT INTO jobs (id, url, priority, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+                    (job_id, url, priority, time.time()),
+                )
+                conn.commit()
+            except sqlite3.IntegrityError:
+                # Another worker process queued the URL first (see the jobs_active_url index)
+                conn.rollback()
+                existing = self.active_job(url)
+                if existing is not None:
+                    return existing, False
+                raise
+            return self.get_job(job_id), True
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db().execute(f"SELECT {self._JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job_row(row) if row is not None else None
+
+    def active_job(self, url: str) -> Optional[Dict[str, Any]]:
+        """The queued or running job for `url`, if any"""
+        with self._lock:
+            row = self._db().execute(
+                f"SELECT {self._JOB_COLUMNS} FROM jobs WHERE url = ? AND status IN ('queued', 'running') "
+                "ORDER BY created_at LIMIT 1",
+                (url,),
+            ).fetchone()
+        return self._job_row(row) if row is not None else None
+
+    def claimable_jobs(self, stale_before: float) -> List[Tuple[str, int, float]]:
+        """(id, priority, created_at) of queued jobs and running jobs whose owner stopped heartbeating"""
+        with self._lock:
+            return self._db().execute(
+                "SELECT id, priority, created_at FROM jobs "
+                "WHERE status = 'queued' OR (status = 'running' AND heartbeat < ?) ORDER BY priority, created_at",
+                (stale_before,),
+            ).fetchall()
+
+    def claim_job(self, job_id: str, owner: str, stale_before: float) -> bool:
+        """Atomically take a queued job, or a running one whose owner stopped heartbeating"""
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            updated = conn.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, heartbeat = ?, started_at = COALESCE(started_at, ?) "
+                "WHERE id = ? AND (status = 'queued' OR (status = 'running' AND heartbeat < ?))",
+                (owner, now, now, job_id, stale_before),
+            ).rowcount
+            conn.commit()
+        return updated == 1
+
+    def heartbeat_job(self, job_id: str, owner: str, progress: Dict[str, Any]) -> bool:
+        """Record progress; False once another worker has taken the job over"""
+        with self._lock:
+            conn = self._db()
+            updated = conn.execute(
+                "UPDATE jobs SET heartbeat = ?, progress = ? WHERE id = ? AND owner = ? AND status = 'running'",
+                (time.time(), json.dumps(progress), job_id, owner),
+            ).rowcount
+            conn.commit()
+        return updated == 1
+
+    def finish_job(self, job_id: str, owner: str, status: str, progress: Dict[str, Any],
+                   result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        with self._lock:
+            conn = self._db()
+            conn.execute(
+                "UPDATE jobs SET status = ?, progress = ?, result = ?, error = ?, finished_at = ? "
+                "WHERE id = ? AND owner = ?",
+                (status, json.dumps(progress), json.dumps(result) if result is not None else None, error,
+                 time.time(), job_id, owner),
+            )
+            conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            conn = self._db()
+            urls = conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+            documents = dict(conn.execute("SELECT status, COUNT(*) FROM documents GROUP BY status").fetchall())
+            chunks = conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+            jobs = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {"urls": urls, "documents": documents, "chunks": chunks, "jobs": jobs}
+
+# Identifies this worker process as a lease owner
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+document_registry = DocumentRegistry(Config.DOCUMENT_REGISTRY_PATH)
@@ -1,20 +1,35 @@
 import asyncio
-import requests
+import httpx
 from typing import List, Optional
 from config import Config
 from cache import get_cache_key, embedding_cache
+from executors import run_io
+from http_client import http_client
+from metrics import timed_stage
+from rate_limiter import PRIORITY_INTERACTIVE, UpstreamError
+from vectors import Vector, batch_from_provider, from_provider
 
-async def gemini_embed_async(texts: List[str], batch_size: int = 10) -> List[Optional[List[float]]]:
-    """Async embedding with batching and caching"""
+EMBED_URL = f"{Config.GEMINI_BASE_URL}/models/embedding-001:embedContent"
+BATCH_EMBED_URL = f"{Config.GEMINI_BASE_URL}/models/embedding-001:batchEmbedContents"
+
+@timed_stage("embedding")
+async def gemini_embed_async(texts: List[str], batch_size: int = 10,
+                             priority: int = PRIORITY_INTERACTIVE) -> List[Optional[Vector]]:
+    """Async embedding with batching and caching.
+
+    `priority` orders these calls in the shared Gemini rate limiter; bulk
+    ingestion passes PRIORITY_BULK so question embeddings are not stuck behind it.
+    """
     embeddings = []
     uncached_texts = []
     uncached_indices = []
     
-    # Check cache first
+    # Check cache first (memory tier, then one batched disk lookup)
+    cache_keys = [get_cache_key(text) for text in texts]
+    cached = await run_io(embedding_cache.get_many, cache_keys)
     for i, text in enumerate(texts):
-        cache_key = get_cache_key(text)
-        if cache_key in embedding_cache:
-            embeddings.append(embedding_cache[cache_key])
+        if cache_keys[i] in cached:
+            embeddings.append(cached[cache_keys[i]])
         else:
             embeddings.append(None)  # Placeholder
             uncached_texts.append(text)
@@ -22,30 +37,37 @@ async def gemini_embed_async(texts: List[str], batch_size: int = 10) -> List[Opt
     
     if not uncached_texts:
         return embeddings
-    
-    # Process uncached texts in batches with parallel requests
-    loop = asyncio.get_event_loop()
-    
-    async def process_batch(batch_texts, batch_start_idx):
-        tasks = []
-        for j, text in enumerate(batch_texts):
-            task = loop.run_in_executor(None, get_embedding_sync, text)
-            tasks.append(task)
-        
-        batch_embeddings = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        # Store in cache and results
-        for j, embedding in enumerate(batch_embeddings):
-            if not isinstance(embedding, Exception) and embedding is not None:
-                original_idx = uncached_indices[batch_start_idx + j]
-                embeddings[original_idx] = embedding
-                cache_key = get_cache_key(batch_texts[j])
-                embedding_cache[cache_key] = embedding
-            else:
-                # Keep None for failed embeddings
-                original_idx = uncached_indices[batch_start_idx + j]
-                embeddings[original_idx] = None
-                print(f"Failed to embed chunk {original_idx}: {batch_texts[j][:50]}...")
+
+    def store_result(original_idx, text, embedding):
+        embeddings[original_idx] = embedding
+
+    if Config.EMBED_USE_BATCH_API:
+        # One batchEmbedContents request per batch, bounded by its own semaphore
+        batch_semaphore = asyncio.Semaphore(Config.EMBED_CONCURRENT_BATCHES)
+
+        async def process_batch(batch_texts, batch_start_idx):
+            async with batch_semaphore:
+                try:
+                    batch_embeddings = await get_embeddings_batch_async(batch_texts, priority=priority)
+                except Exception as e:
+                    print(f"Batch embedding failed, falling back to single requests: {e}")
+                    batch_embeddings = [None] * len(batch_texts)
+            for j, embedding in enumerate(batch_embeddings):
+                if embedding is not None:
+                    store_result(uncached_indices[batch_start_idx + j], batch_texts[j], embedding)
+    else:
+        single_semaphore = asyncio.Semaphore(Config.EMBED_CONCURRENT_SINGLE)
+
+        async def embed_one(text):
+            async with single_semaphore:
+                return await get_embedding_async(text, priority=priority)
+
+        async def process_batch(batch_texts, batch_start_idx):
+            batch_embeddings = await asyncio.gather(*[embed_one(text) for text in batch_texts], return_exceptions=True)
+            
+            for j, embedding in enumerate(batch_embeddings):
+                if not isinstance(embedding, Exception) and embedding is not None:
+                    store_result(uncached_indices[batch_start_idx + j], batch_texts[j], embedding)
     
     # Process all batches in parallel
     batches = [uncached_texts[i:i + batch_size] for i in range(0, len(uncached_texts), batch_size)]
@@ -55,75 +77,109 @@ async def gemini_embed_async(texts: List[str], batch_size: int = 10) -> List[Opt
         batch_tasks.append(process_batch(batch, batch_start_idx))
     
     await asyncio.gather(*batch_tasks)
+
+    # Retry items that a batch dropped or rejected through the single-item path
+    missing = [(idx, text) for idx, text in zip(uncached_indices, uncached_texts) if embeddings[idx] is None]
+    if missing and Config.EMBED_USE_BATCH_API:
+        print(f"Retrying {len(missing)} failed batch items individually")
+        single_semaphore = asyncio.Semaphore(Config.EMBED_CONCURRENT_SINGLE)
+
+        async def retry_single(original_idx, text):
+            async with single_semaphore:
+                try:
+                    embedding = await get_embedding_async(text, priority=priority)
+                except Exception as e:
+                    print(f"Error embedding chunk {original_idx}: {e}")
+                    embedding = None
+            if embedding is not None:
+                store_result(original_idx, text, embedding)
+
+        await asyncio.gather(*[retry_single(idx, text) for idx, text in missing])
+
+    fresh = []
+    for idx, text in zip(uncached_indices, uncached_texts):
+        if embeddings[idx] is None:
+            print(f"Failed to embed chunk {idx}: {text[:50]}...")
+        else:
+            fresh.append((cache_keys[idx], embeddings[idx]))
+    await run_io(embedding_cache.set_many, fresh)
     
     return embeddings
 
-def get_embedding_sync(text: str, max_retries: int = 3) -> Optional[List[float]]:
-    """Get single embedding synchronously with retry logic"""
+async def get_embeddings_batch_async(texts: List[str], max_retries: int = 3,
+                                     priority: int = PRIORITY_INTERACTIVE) -> List[Optional[Vector]]:
+    """Embed many texts with one batchEmbedContents request.
+
+    Returns one entry per input; entries the API did not return are None so
+    the caller can retry them individually.
+    """
+    if not Config.GOOGLE_API_KEY:
+        raise ValueError("GOOGLE_API_KEY environment variable is not set")
+
+    body = {
+        "requests": [
+            {"model": "models/embedding-001", "content": {"parts": [{"text": text}]}}
+            for text in texts
+        ]
+    }
+
+    response = await http_client.post(
+        BATCH_EMBED_URL,
+        params={"key": Config.GOOGLE_API_KEY},
+        json=body,
+        timeout=60,
+        max_retries=max_retries,
+        provider="gemini",
+        priority=priority,
+    )
+
+    if response.status_code != 200:
+        # A single bad item rejects the whole batch; let the caller retry per item
+        print(f"Batch embedding error: {response.status_code}, {response.text[:200]}")
+        return [None] * len(texts)
+
+    results = response.json().get("embeddings", [])
+    # One float32 matrix for the batch; callers get zero-copy row views
+    return batch_from_provider([
+        results[i].get("values") if i < len(results) else None
+        for i in range(len(texts))
+    ])
+
+async def get_embedding_async(text: str, max_retries: int = 3,
+                              priority: int = PRIORITY_INTERACTIVE) -> Optional[Vector]:
+    """Get single embedding with retry logic"""
     if not Config.GOOGLE_API_KEY:
         raise ValueError("GOOGLE_API_KEY environment variable is not set")
         
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/embedding-001:embedContent?key={Config.GOOGLE_API_KEY}"
-    headers = {"Content-Type": "application/json"}
     body = {
         "model": "models/embedding-001",
         "content": {"parts": [{"text": text}]}
     }
     
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(url, json=body, headers=headers, timeout=30)
-            
-            if response.status_code == 503:  # Service unavailable
-                if attempt < max_retries - 1:
-                    import time
-                    wait_time = 2 ** attempt  # Exponential backoff
-                    print(f"503 error, retrying in {wait_time}s... (attempt {attempt + 1}/{max_retries})")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    print(f"Max retries reached for text: {text[:50]}...")
-                    return None
-            
-            if response.status_code != 200:
-                print(f"Error: {response.status_code}, {response.text}")
-                if attempt < max_retries - 1:
-                    import time
-                    time.sleep(1)
-                    continue
-                return None
-            
-            response_data = response.json()
-            if 'embedding' in response_data:
-                return response_data['embedding']['values']
-            else:
-                print(f"Unexpected response format: {response_data}")
-                if attempt < max_retries - 1:
-                    import time
-                    time.sleep(1)
-                    continue
-                return None
-                
-        except requests.exceptions.Timeout:
-            if attempt < max_retries - 1:
-                print(f"Timeout, retrying... (attempt {attempt + 1}/{max_retries})")
-                import time
-                time.sleep(1)
-                continue
-            print(f"Timeout after {max_retries} attempts for text: {text[:50]}...")
-            return None
-        except Exception as e:
-            if attempt < max_retries - 1:
-                print(f"Error: {e}, retrying... (attempt {attempt + 1}/{max_retries})")
-                import time
-                time.sleep(1)
-                continue
-            print(f"Error getting embedding after {max_retries} attempts: {e}")
-            return None
+    try:
+        response = await http_client.post(
+            EMBED_URL,
+            params={"key": Config.GOOGLE_API_KEY},
+            json=body,
+            max_retries=max_retries,
+            provider="gemini",
+            priority=priority,
+        )
+    except (httpx.HTTPError, UpstreamError) as e:
+        print(f"Error getting embedding after {max_retries} attempts: {e}")
+        return None
+    
+    if response.status_code != 200:
+        print(f"Error: {response.status_code}, {response.text[:200]}")
+        return None
     
+    response_data = response.json()
+    if 'embedding' in response_data:
+        return from_provider(response_data['embedding']['values'])
+    print(f"Unexpected response format: {response_data}")
     return None
 
 # --- Synchronous wrapper for backward compatibility ---
-def gemini_embed(texts: List[str]) -> List[Optional[List[float]]]:
+def gemini_embed(texts: List[str]) -> List[Optional[Vector]]:
     """Synchronous wrapper for async embedding"""
     return asyncio.run(gemini_embed_async(texts))
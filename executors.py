@@ -0,0 +1,77 @@
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from config import Config
+
+class _PoolCounters:
+    def __init__(self):
+        self.submitted = 0
+        self.in_flight = 0
+
+_io_pool: Optional[ThreadPoolExecutor] = None
+_cpu_pool: Optional[ThreadPoolExecutor] = None
+_pdf_process_pool: Optional[ProcessPoolExecutor] = None
+_counters: Dict[str, _PoolCounters] = {"io": _PoolCounters(), "cpu": _PoolCounters(), "pdf": _PoolCounters()}
+
+def get_io_pool() -> ThreadPoolExecutor:
+    """Threads for blocking I/O: vector store calls, SQLite and log files"""
+    global _io_pool
+    if _io_pool is None:
+        _io_pool = ThreadPoolExecutor(max_workers=Config.IO_THREADS, thread_name_prefix="rag-io")
+    return _io_pool
+
+def get_cpu_pool() -> ThreadPoolExecutor:
+    """Threads for CPU work that mostly runs in NumPy/C code (chunking, BM25, reranking, PDF parsing)"""
+    global _cpu_pool
+    if _cpu_pool is None:
+        _cpu_pool = ThreadPoolExecutor(max_workers=Config.CPU_THREADS, thread_name_prefix="rag-cpu")
+    return _cpu_pool
+
+def get_pdf_process_pool() -> ProcessPoolExecutor:
+    """Lazily start the worker processes used for page-range extraction"""
+    global _pdf_process_pool
+    if _pdf_process_pool is None:
+        _pdf_process_pool = ProcessPoolExecutor(
+            max_workers=Config.PDF_EXTRACT_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pdf_process_pool
+
+async def _run(name: str, pool: Executor, fn: Callable[..., Any], *args, **kwargs) -> Any:
+    counters = _counters[name]
+    counters.submitted += 1
+    counters.in_flight += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, functools.partial(fn, *args, **kwargs))
+    finally:
+        counters.in_flight -= 1
+
+async def run_io(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run a blocking I/O call on the I/O thread pool"""
+    return await _run("io", get_io_pool(), fn, *args, **kwargs)
+
+async def run_cpu(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run a CPU-bound call on the CPU thread pool"""
+    return await _run("cpu", get_cpu_pool(), fn, *args, **kwargs)
+
+async def run_pdf(fn: Callable[..., Any], *args) -> Any:
+    """Run a picklable function in the PDF worker processes"""
+    return await _run("pdf", get_pdf_process_pool(), fn, *args)
+
+def executor_stats() -> Dict[str, Any]:
+    sizes = {"io": Config.IO_THREADS, "cpu": Config.CPU_THREADS, "pdf": Config.PDF_EXTRACT_PROCESSES}
+    return {
+        name: {"workers": sizes[name], "in_flight": counters.in_flight, "submitted": counters.submitted}
+        for name, counters in _counters.items()
+    }
+
+def shutdown_executors():
+    """Stop all pools; pending work is cancelled rather than awaited"""
+    global _io_pool, _cpu_pool, _pdf_process_pool
+    for pool in (_io_pool, _cpu_pool, _pdf_process_pool):
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+    _io_pool = _cpu_pool = _pdf_process_pool = None
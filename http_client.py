@@ -0,0 +1,203 @@
+import asyncio
+import random
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+from config import Config
+from metrics import UPSTREAM_ERRORS
+from rate_limiter import (
+    PRIORITY_INTERACTIVE, AdaptiveRateLimiter, CircuitBreaker, CircuitOpenError, get_circuit_breaker, get_rate_limiter
+)
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 10.0) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+def retry_after_seconds(response: httpx.Response) -> Optional[float]:
+    """Parse a numeric Retry-After header, if present"""
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+class HTTPClient:
+    """Shared async HTTP client with keep-alive pools and per-host concurrency limits.
+
+    httpx keeps one connection pool per origin; on top of that each host gets
+    a semaphore sized from Config.HTTP_HOST_CONCURRENCY so a burst against one
+    provider cannot starve the others. State is tied to the running event loop
+    so the synchronous `asyncio.run` wrappers get a fresh client.
+
+    Calls tagged with a `provider` additionally go through that provider's
+    shared adaptive rate limiter (served by `priority`) and circuit breaker.
+    """
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def _ensure_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                http2=Config.HTTP2 and HTTP2_AVAILABLE,
+                timeout=Config.HTTP_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=Config.HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=Config.HTTP_MAX_KEEPALIVE,
+                    keepalive_expiry=Config.HTTP_KEEPALIVE_EXPIRY,
+                ),
+                follow_redirects=True,
+            )
+            self._loop = loop
+            self._host_semaphores = {}
+        return self._client
+
+    def _host_semaphore(self, host: str) -> asyncio.Semaphore:
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            limit = Config.HTTP_HOST_CONCURRENCY.get(host, Config.HTTP_DEFAULT_HOST_CONCURRENCY)
+            semaphore = self._host_semaphores[host] = asyncio.Semaphore(limit)
+        return semaphore
+
+    async def request(self, method: str, url: str, max_retries: int = 3, provider: Optional[str] = None,
+                      priority: int = PRIORITY_INTERACTIVE, **kwargs) -> httpx.Response:
+        """Send a request, retrying transport errors and 429/5xx with jittered backoff.
+
+        The final response is returned as-is (even if it is an error status);
+        the last transport error is re-raised, and CircuitOpenError is raised
+        without sending anything while the provider's circuit is open.
+        """
+        client = self._ensure_client()
+        semaphore = self._host_semaphore(urlsplit(url).netloc)
+        limiter = get_rate_limiter(provider) if provider else None
+
+        for attempt in range(max_retries):
+            last_attempt = attempt == max_retries - 1
+            try:
+                response = await self._send(client, semaphore, provider, priority, method, url, **kwargs)
+            except httpx.TransportError as e:
+                if last_attempt:
+                    raise
+                wait_time = backoff_delay(attempt)
+                print(f"{type(e).__name__} for {urlsplit(url).netloc}, retrying in {wait_time:.2f}s... (attempt {attempt + 1}/{max_retries})")
+                await asyncio.sleep(wait_time)
+                continue
+
+            if response.status_code in RETRY_STATUSES and not last_attempt:
+                if response.status_code == 429 and limiter is not None:
+                    # The limiter has already slowed (and, for Retry-After, paused) every caller of this provider
+                    wait_time = 0.0
+                else:
+                    wait_time = retry_after_seconds(response)
+                    if wait_time is None:
+                        wait_time = backoff_delay(attempt)
+                print(f"{response.status_code} from {urlsplit(url).netloc}, retrying in {wait_time:.2f}s... (attempt {attempt + 1}/{max_retries})")
+                await response.aclose()
+                if wait_time:
+                    await asyncio.sleep(wait_time)
+                continue
+            return response
+
+        raise RuntimeError("max_retries must be at least 1")
+
+    async def _send(self, client: httpx.AsyncClient, semaphore: asyncio.Semaphore, provider: Optional[str],
+                    priority: int, method: str, url: str, **kwargs) -> httpx.Response:
+        limiter, breaker = self._guards(provider)
+        try:
+            if limiter is not None:
+                await limiter.acquire(priority)
+            async with semaphore:
+                response = await client.request(method, url, **kwargs)
+        except httpx.TransportError:
+            if breaker is not None:
+                breaker.record_failure()
+                UPSTREAM_ERRORS.labels(provider, "transport").inc()
+            raise
+        except BaseException:
+            if breaker is not None:
+                breaker.release()
+            raise
+        self._record_response(response, provider, limiter, breaker)
+        return response
+
+    @staticmethod
+    def _guards(provider: Optional[str]) -> Tuple[Optional[AdaptiveRateLimiter], Optional[CircuitBreaker]]:
+        """The provider's rate limiter and circuit breaker; checks the breaker (may raise CircuitOpenError)"""
+        if not provider:
+            return None, None
+        breaker = get_circuit_breaker(provider)
+        try:
+            breaker.before_call()
+        except CircuitOpenError:
+            UPSTREAM_ERRORS.labels(provider, "circuit_open").inc()
+            raise
+        return get_rate_limiter(provider), breaker
+
+    @staticmethod
+    def _record_response(response: httpx.Response, provider: Optional[str],
+                         limiter: Optional[AdaptiveRateLimiter], breaker: Optional[CircuitBreaker]):
+        if provider and response.status_code >= 400:
+            UPSTREAM_ERRORS.labels(provider, str(response.status_code)).inc()
+        if breaker is not None:
+            # Throttling is the limiter's business; only server errors count against the circuit
+            if response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+        if limiter is not None:
+            if response.status_code == 429:
+                limiter.on_throttle(retry_after_seconds(response))
+            elif response.status_code < 400:
+                limiter.on_success()
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, provider: Optional[str] = None,
+                     priority: int = PRIORITY_INTERACTIVE, **kwargs) -> AsyncIterator[httpx.Response]:
+        """Open a streaming response (no retries: a partially consumed body cannot be replayed)"""
+        client = self._ensure_client()
+        limiter, breaker = self._guards(provider)
+        try:
+            if limiter is not None:
+                await limiter.acquire(priority)
+            async with self._host_semaphore(urlsplit(url).netloc):
+                async with client.stream(method, url, **kwargs) as response:
+                    self._record_response(response, provider, limiter, breaker)
+                    yield response
+        except httpx.TransportError:
+            if breaker is not None:
+                breaker.record_failure()
+                UPSTREAM_ERRORS.labels(provider, "transport").inc()
+            raise
+        except BaseException:
+            if breaker is not None:
+                breaker.release()
+            raise
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._loop = None
+
+http_client = HTTPClient()
@@ -0,0 +1,309 @@
+import time
+import asyncio
+from typing import AsyncIterator, Dict, Any, List, Optional, Tuple
+
+from config import Config
+from executors import run_cpu, run_io
+from cache import get_cache_key
+from document_processor import Chunk, Chunker, chunk_document, extract_pages_async, iter_pdf_pages
+from document_registry import document_registry
+from embeddings import gemini_embed_async
+from rate_limiter import PRIORITY_BULK
+from vector_store import chunk_vector_id, delete_vectors_async, set_namespace_chunks, store_chunks_async
+from bm25 import BM25Builder, set_sparse_index
+
+_DONE = object()  # Queue sentinel
+
+async def iter_chunks(pages: AsyncIterator[str], chunk_size: int = 300, overlap: int = 50,
+                      boundary: str = "token") -> AsyncIterator[Chunk]:
+    """Emit offset-tracked chunks as soon as the pages covering them have arrived"""
+    chunker = Chunker(chunk_size, overlap, boundary)
+    async for page in pages:
+        for chunk in await run_cpu(chunker.feed, page):
+            yield chunk
+    for chunk in await run_cpu(chunker.flush):
+        yield chunk
+
+def _add_sparse(builder: BM25Builder, start_ordinal: int, batch: List[Chunk]):
+    for ordinal, chunk in enumerate(batch, start=start_ordinal):
+        builder.add(ordinal, chunk.text, chunk.start, chunk.end)
+
+class _StageTimer:
+    """Accumulates busy time per pipeline stage"""
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float):
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+async def _timed_iter(aiter: AsyncIterator, timer: _StageTimer, stage: str) -> AsyncIterator:
+    """Wrap an async iterator, charging the time spent producing each item to `stage`"""
+    while True:
+        start = time.time()
+        try:
+            item = await aiter.__anext__()
+        except StopAsyncIteration:
+            timer.add(stage, time.time() - start)
+            return
+        timer.add(stage, time.time() - start)
+        yield item
+
+def new_progress(stage: str = "queued") -> Dict[str, Any]:
+    """Per-stage progress counters, updated in place while a document is ingested"""
+    return {"stage": stage, "pages": 0, "chunks": 0, "embedded": 0, "stored": 0, "reused": 0}
+
+async def ingest_document_streaming(pdf_bytes: bytes, namespace: str, content_hash: str,
+                                    progress: Optional[Dict[str, Any]] = None,
+                                    checkpoint: Optional[Dict[int, Tuple[str, bool]]] = None) -> Dict[str, Any]:
+    """Extract, chunk, embed and upsert a downloaded document as an overlapping pipeline.
+
+    Pages are chunked as they are extracted; full chunk batches go through a
+    bounded queue to embedding workers, whose results go through a second
+    bounded queue to upsert workers, which also record each stored batch in
+    the document registry under `content_hash`. PyPDF2 needs the complete
+    file, so the download happens before the pipeline starts.
+
+    `checkpoint` (from DocumentRegistry.get_checkpoint) lists the batches an
+    interrupted attempt already stored; batches found there unchanged are
+    not embedded or upserted again. `progress` (see new_progress) counts
+    pages, chunks, embedded and stored chunks as the pipeline advances.
+    """
+    timer = _StageTimer()
+    wall_start = time.time()
+    progress = progress if progress is not None else new_progress()
+    checkpoint = checkpoint or {}
+    # Text hash -> ordinal of its first occurrence: a repeated text shares that chunk's vector
+    # (see make_vector_id), so only the first occurrence is upserted
+    first_ordinals: Dict[str, int] = {}
+
+    embed_queue: asyncio.Queue = asyncio.Queue(maxsize=Config.PIPELINE_QUEUE_SIZE)
+    upsert_queue: asyncio.Queue = asyncio.Queue(maxsize=Config.PIPELINE_QUEUE_SIZE)
+    stats = {"pages": 0, "chunks": 0, "successful_embeddings": 0, "failed_embeddings": 0, "resumed_chunks": 0}
+    sparse_builder = BM25Builder() if Config.HYBRID_RETRIEVAL else None
+
+    async def count_pages(pages):
+        async for page in pages:
+            stats["pages"] += 1
+            progress["pages"] += 1
+            yield page
+
+    def stored_before(start_ordinal: int, batch: List[Chunk]) -> bool:
+        return all(
+            checkpoint.get(ordinal, (None,))[0] == chunk.text
+            for ordinal, chunk in enumerate(batch, start=start_ordinal)
+        )
+
+    async def emit(start_ordinal: int, batch: List[Chunk]):
+        if sparse_builder is not None:
+            await run_cpu(_add_sparse, sparse_builder, start_ordinal, batch)
+        if checkpoint and stored_before(start_ordinal, batch):
+            embedded = sum(1 for ordinal in range(start_ordinal, start_ordinal + len(batch)) if checkpoint[ordinal][1])
+            stats["successful_embeddings"] += embedded
+            stats["failed_embeddings"] += len(batch) - embedded
+            stats["resumed_chunks"] += len(batch)
+            for counter in ("embedded", "stored", "reused"):
+                progress[counter] += len(batch)
+            return
+        await embed_queue.put((start_ordinal, batch))
+
+    async def produce_batches():
+        """Extraction + chunking stage: feeds ordinal-tagged chunk batches"""
+        pages = _timed_iter(iter_pdf_pages(pdf_bytes), timer, "pdf_processing")
+        chunks = _timed_iter(
+            iter_chunks(count_pages(pages), Config.CHUNK_SIZE, Config.CHUNK_OVERLAP, Config.CHUNK_BOUNDARY),
+            timer, "chunking"
+        )
+        batch: List[Chunk] = []
+        start_ordinal = 0
+        async for chunk in chunks:
+            batch.append(chunk)
+            progress["chunks"] += 1
+            first_ordinals.setdefault(get_cache_key(chunk.text), start_ordinal + len(batch) - 1)
+            if len(batch) >= Config.BATCH_SIZE:
+                await emit(start_ordinal, batch)
+                start_ordinal += len(batch)
+                batch = []
+        if batch:
+            await emit(start_ordinal, batch)
+            start_ordinal += len(batch)
+        stats["chunks"] = start_ordinal
+        # The chunk iterator's time includes the page extraction it awaited
+        timer.timings["chunking"] = max(0.0, timer.timings.get("chunking", 0.0) - timer.timings.get("pdf_processing", 0.0))
+        for _ in range(Config.EMBED_CONCURRENT_BATCHES):
+            await embed_queue.put(_DONE)
+
+    async def embed_worker():
+        while True:
+            item = await embed_queue.get()
+            if item is _DONE:
+                return
+            start_ordinal, batch = item
+            start = time.time()
+            embeddings = await gemini_embed_async(
+                [chunk.text for chunk in batch], batch_size=Config.BATCH_SIZE, priority=PRIORITY_BULK
+            )
+            timer.add("embedding", time.time() - start)
+            successful = sum(1 for emb in embeddings if emb is not None)
+            stats["successful_embeddings"] += successful
+            stats["failed_embeddings"] += len(batch) - successful
+            progress["embedded"] += len(batch)
+            await upsert_queue.put((start_ordinal, batch, embeddings))
+
+    async def upsert_worker():
+        while True:
+            item = await upsert_queue.get()
+            if item is _DONE:
+                return
+            start_ordinal, batch, embeddings = item
+            start = time.time()
+            first = [
+                j for j, chunk in enumerate(batch)
+                if first_ordinals[get_cache_key(chunk.text)] == start_ordinal + j
+            ]
+            await store_chunks_async(
+                [batch[j] for j in first], [embeddings[j] for j in first], namespace,
+                ordinals=[start_ordinal + j for j in first],
+            )
+            await run_io(
+                document_registry.add_chunks, content_hash, start_ordinal, batch, [emb is not None for emb in embeddings]
+            )
+            timer.add("vector_storage", time.time() - start)
+            progress["stored"] += len(batch)
+
+    async def run_embedders():
+        await asyncio.gather(*[embed_worker() for _ in range(Config.EMBED_CONCURRENT_BATCHES)])
+        for _ in range(Config.CONCURRENT_UPLOADS):
+            await upsert_queue.put(_DONE)
+
+    tasks = [
+        asyncio.ensure_future(produce_batches()),
+        asyncio.ensure_future(run_embedders()),
+    ] + [asyncio.ensure_future(upsert_worker()) for _ in range(Config.CONCURRENT_UPLOADS)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    if stats["chunks"] == 0:
+        raise ValueError("No text chunks were generated from the document")
+
+    if checkpoint:
+        # The interrupted attempt chunked differently (settings changed in between)
+        stale = {get_cache_key(text) for text, embedded in checkpoint.values() if embedded} - first_ordinals.keys()
+        if stale:
+            await delete_vectors_async([chunk_vector_id(namespace, key) for key in stale], namespace)
+        await run_io(document_registry.truncate_chunks, content_hash, stats["chunks"])
+
+    if sparse_builder is not None:
+        sparse_start = time.time()
+        set_sparse_index(namespace, await run_cpu(sparse_builder.build))
+        timer.add("sparse_index", time.time() - sparse_start)
+
+    stats["timings"] = timer.timings
+    stats["wall_time"] = time.time() - wall_start
+    return stats
+
+async def _discard_vectors(ids: List[str], namespace: str):
+    """Best-effort delete: a failure is logged instead of failing an update that otherwise succeeded"""
+    try:
+        await delete_vectors_async(ids, namespace)
+    except Exception as e:
+        print(f"Could not delete {len(ids)} vectors from namespace {namespace}: {e}")
+
+async def ingest_document_incremental(pdf_bytes: bytes, namespace: str, content_hash: str,
+                                      previous_hash: str, progress: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Update a namespace holding an earlier version of the document to the new PDF bytes.
+
+    Chunks are identified by the hash of their text (see make_vector_id). Only
+    chunks without a stored vector in the previous version are embedded and
+    upserted, and vectors of chunks that no longer occur are deleted in
+    batches, so the upstream cost follows the size of the change. Extraction
+    and chunking still cover the whole document.
+
+    The update is committed in the registry (see DocumentRegistry.mark_ready)
+    before retrieval switches over and removed vectors are deleted; if it
+    fails earlier, the vectors it added are deleted again and the previous
+    version stays live.
+    """
+    timer = _StageTimer()
+    wall_start = time.time()
+    progress = progress if progress is not None else new_progress()
+
+    start = time.time()
+    pages = await extract_pages_async(pdf_bytes)
+    timer.add("pdf_processing", time.time() - start)
+    progress["pages"] = len(pages)
+
+    start = time.time()
+    chunks = await run_cpu(chunk_document, pages, Config.CHUNK_SIZE, Config.CHUNK_OVERLAP, Config.CHUNK_BOUNDARY)
+    timer.add("chunking", time.time() - start)
+    if not chunks:
+        raise ValueError("No text chunks were generated from the document")
+    progress["chunks"] = len(chunks)
+
+    stored = await run_io(document_registry.get_embedding_keys, previous_hash)
+    keys = [get_cache_key(chunk.text) for chunk in chunks]
+    added = [i for i, key in enumerate(keys) if key not in stored]
+    removed = stored - set(keys)
+    # Unchanged chunks are already embedded and stored
+    progress["reused"] = len(chunks) - len(added)
+    progress["embedded"] = progress["stored"] = progress["reused"]
+
+    # Until the update commits, retrieval keeps seeing only the previous version's chunks
+    set_namespace_chunks(namespace, await run_io(document_registry.get_chunks, previous_hash))
+    embedded = [True] * len(chunks)
+    failed = 0
+    try:
+        if added:
+            start = time.time()
+            embeddings = await gemini_embed_async(
+                [chunks[i].text for i in added], batch_size=Config.BATCH_SIZE, priority=PRIORITY_BULK
+            )
+            timer.add("embedding", time.time() - start)
+            for i, emb in zip(added, embeddings):
+                embedded[i] = emb is not None
+            failed = sum(1 for emb in embeddings if emb is None)
+            progress["embedded"] = len(chunks)
+
+            start = time.time()
+            await store_chunks_async([chunks[i] for i in added], embeddings, namespace, ordinals=added)
+            timer.add("vector_storage", time.time() - start)
+            progress["stored"] = len(chunks)
+
+        await run_io(document_registry.add_chunks, content_hash, 0, chunks, embedded)
+        # The new version replaces the previous one in a single registry transaction. Before
+        # that the previous version stays 'ready', so a failed update is retried against it.
+        await run_io(document_registry.mark_ready, content_hash, len(pages), len(chunks), previous_hash)
+    except BaseException:
+        if added:
+            await _discard_vectors([chunk_vector_id(namespace, key) for key in {keys[i] for i in added}], namespace)
+        raise
+
+    # Switch retrieval to the new chunk set before the removed vectors are gone
+    set_namespace_chunks(namespace, chunks)
+    if Config.HYBRID_RETRIEVAL:
+        start = time.time()
+        sparse_builder = BM25Builder()
+        await run_cpu(_add_sparse, sparse_builder, 0, chunks)
+        set_sparse_index(namespace, await run_cpu(sparse_builder.build))
+        timer.add("sparse_index", time.time() - start)
+
+    if removed:
+        start = time.time()
+        await _discard_vectors([chunk_vector_id(namespace, key) for key in removed], namespace)
+        timer.add("vector_storage", time.time() - start)
+
+    return {
+        "pages": len(pages),
+        "chunks": len(chunks),
+        "successful_embeddings": len(chunks) - failed,
+        "failed_embeddings": failed,
+        "added": len(added),
+        "removed": len(removed),
+        "unchanged": len(chunks) - len(added),
+        "timings": timer.timings,
+        "wall_time": time.time() - wall_start,
+    }
@@ -0,0 +1,178 @@
+import time
+import uuid
+import asyncio
+import itertools
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from config import Config
+from document_registry import WORKER_ID, document_registry
+from executors import run_io
+from ingestion import new_progress
+from metrics import request_id_var
+
+# Priorities accepted by POST /hackrx/ingest; lower values run first
+JOB_PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+_PRIORITY_NAMES = {value: name for name, value in JOB_PRIORITIES.items()}
+
+class QueueFull(Exception):
+    """This worker already holds INGESTION_JOB_QUEUE_SIZE queued jobs"""
+
+class IngestionScheduler:
+    """Background ingestion jobs run by a bounded pool of worker tasks.
+
+    Jobs live in the document registry, so their status is visible to every
+    worker process and survives restarts. Each process runs `workers` tasks
+    that take jobs by priority, then age, and claim them atomically; a
+    running job saves its progress as a heartbeat. A job whose owner stopped
+    heartbeating (the process died or shut down) is claimed again by the
+    periodic rescan and resumes after the chunk batches already stored (see
+    RAGService._ingest_document). Requests for a document being ingested by
+    a job join it through the per-URL single flight or, in other worker
+    processes, the ingestion lease.
+    """
+
+    def __init__(self, ingest: Callable[[str, Dict[str, Any]], Awaitable[Dict[str, Any]]],
+                 workers: int = 2, queue_size: int = 100):
+        self._ingest = ingest
+        self.workers = workers
+        self.queue_size = queue_size
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._queued: Set[str] = set()
+        self._running: Dict[str, Dict[str, Any]] = {}  # Job ID -> live progress
+        self._tasks: List[asyncio.Task] = []
+        self._submit_lock = asyncio.Lock()
+        self._sequence = itertools.count()
+        self.completed = 0
+        self.failed = 0
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.ensure_future(self._rescan()))
+
+    def stop(self):
+        """Cancel the worker tasks; interrupted jobs are resumed by whichever worker next rescans"""
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def submit(self, url: str, priority: str = "normal") -> Tuple[Dict[str, Any], bool]:
+        """Queue ingestion of `url`. Returns (job, created); a queued or running job for the URL is returned as-is"""
+        async with self._submit_lock:
+            existing = await run_io(document_registry.active_job, url)
+            if existing is not None:
+                return self._view(existing), False
+            if len(self._queued) >= self.queue_size:
+                raise QueueFull(f"{len(self._queued)} ingestion jobs already queued")
+            job, created = await run_io(document_registry.create_job, uuid.uuid4().hex[:12], url, JOB_PRIORITIES[priority])
+        if not created:
+            return self._view(job), False
+        self._enqueue(job["id"], job["priority"], job["created_at"])
+        print(f"Queued ingestion job {job['id']} ({priority}) for {url}")
+        return self._view(job), True
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = await run_io(document_registry.get_job, job_id)
+        return self._view(job) if job is not None else None
+
+    def _view(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """API representation of a job row, with live progress if it runs in this process"""
+        live = self._running.get(job["id"])
+        def timestamp(value: Optional[float]) -> Optional[str]:
+            return datetime.fromtimestamp(value).isoformat() if value is not None else None
+        return {
+            "job_id": job["id"],
+            "url": job["url"],
+            "status": job["status"],
+            "priority": _PRIORITY_NAMES.get(job["priority"], str(job["priority"])),
+            "progress": dict(live) if live is not None else job["progress"] or new_progress(job["status"]),
+            "result": job["result"],
+            "error": job["error"],
+            "created_at": timestamp(job["created_at"]),
+            "started_at": timestamp(job["started_at"]),
+            "finished_at": timestamp(job["finished_at"]),
+        }
+
+    def _enqueue(self, job_id: str, priority: int, created_at: float):
+        if job_id in self._queued or job_id in self._running:
+            return
+        self._queued.add(job_id)
+        self._queue.put_nowait((priority, created_at, next(self._sequence), job_id))
+
+    @staticmethod
+    def _stale_before() -> float:
+        return time.time() - Config.INGESTION_LEASE_SECONDS
+
+    async def _worker(self):
+        while True:
+            _, _, _, job_id = await self._queue.get()
+            self._queued.discard(job_id)
+            try:
+                # Another worker process may have taken it (or finished it) since it was queued here
+                if await run_io(document_registry.claim_job, job_id, WORKER_ID, self._stale_before()):
+                    await self._run(job_id)
+            except Exception as e:
+                # E.g. "database is locked": a job left claimed is picked up again once its heartbeat is stale
+                print(f"Ingestion job {job_id}: registry error, leaving it to the rescan: {e}")
+
+    async def _run(self, job_id: str):
+        """Run a claimed job and record its outcome.
+
+        If the outcome cannot be recorded the job stays 'running' without a
+        heartbeat, so the rescan hands it to a worker again (which finds the
+        document registered, or resumes it).
+        """
+        request_id_var.set(f"job-{job_id}")
+        # A resumed job counts from zero again; batches kept from its last run show up as "reused"
+        progress = new_progress("starting")
+        self._running[job_id] = progress
+        heartbeat = asyncio.ensure_future(self._heartbeat(job_id, progress))
+        try:
+            job = await run_io(document_registry.get_job, job_id)
+            try:
+                result = await self._ingest(job["url"], progress)
+            except Exception as e:
+                print(f"Ingestion job {job_id} failed: {e}")
+                progress["stage"] = "failed"
+                await run_io(document_registry.finish_job, job_id, WORKER_ID, "failed", progress, None, str(e))
+                self.failed += 1
+            else:
+                progress["stage"] = "done"
+                await run_io(document_registry.finish_job, job_id, WORKER_ID, "done", progress, result)
+                self.completed += 1
+                print(f"Ingestion job {job_id} done in {result['total_time']:.2f} seconds")
+        finally:
+            heartbeat.cancel()
+            self._running.pop(job_id, None)
+
+    async def _heartbeat(self, job_id: str, progress: Dict[str, Any]):
+        while True:
+            await asyncio.sleep(Config.INGESTION_JOB_PROGRESS_SECONDS)
+            try:
+                if not await run_io(document_registry.heartbeat_job, job_id, WORKER_ID, dict(progress)):
+                    print(f"Ingestion job {job_id} was taken over by another worker")
+                    return
+            except Exception as e:
+                # A missed beat is harmless; the job only goes stale after INGESTION_LEASE_SECONDS
+                print(f"Ingestion job {job_id}: heartbeat failed: {e}")
+
+    async def _rescan(self):
+        """Queue jobs left behind by stopped workers (and, at startup, by this one's previous run)"""
+        while True:
+            try:
+                for job_id, priority, created_at in await run_io(document_registry.claimable_jobs, self._stale_before()):
+                    self._enqueue(job_id, priority, created_at)
+            except Exception as e:
+                print(f"Ingestion job rescan failed, retrying later: {e}")
+            await asyncio.sleep(Config.INGESTION_JOB_RESCAN_SECONDS)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queued": len(self._queued),
+            "running": len(self._running),
+            "completed": self.completed,
+            "failed": self.failed,
+        }
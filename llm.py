@@ -1,17 +1,28 @@
+import json
 import asyncio
-import requests
+import httpx
+from typing import Any, AsyncIterator, Dict, Tuple
 from config import Config
+from http_client import http_client, retry_after_seconds
+from metrics import stage_span, timed_stage
+from rate_limiter import UpstreamError
+
+CHAT_COMPLETIONS_URL = f"{Config.OPENAI_BASE_URL}/chat/completions"
 
 async def query_gpt4_async(prompt: str) -> str:
     """Async GPT-4 query for parallel processing"""
+    answer, _ = await query_gpt4_with_usage_async(prompt)
+    return answer
+
+@timed_stage("llm")
+async def query_gpt4_with_usage_async(prompt: str, max_tokens: int = None, json_mode: bool = False) -> Tuple[str, Dict[str, Any]]:
+    """GPT-4 query that also returns the API's token usage block.
+
+    Raises UpstreamError when the API fails or returns an unusable response.
+    """
     if not Config.OPENAI_API_KEY:
         raise ValueError("OPENAI_API_KEY environment variable is not set")
-        
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, query_gpt4_sync, prompt)
 
-def query_gpt4_sync(prompt: str) -> str:
-    """Synchronous GPT-4 query"""
     headers = {
         "Authorization": f"Bearer {Config.OPENAI_API_KEY}",
         "Content-Type": "application/json"
@@ -20,21 +31,65 @@ def query_gpt4_sync(prompt: str) -> str:
         "model": Config.GPT_MODEL,
         "messages": [{"role": "user", "content": prompt}],
         "temperature": Config.GPT_TEMPERATURE,
-        "max_tokens": Config.GPT_MAX_TOKENS
+        "max_tokens": max_tokens or Config.GPT_MAX_TOKENS
     }
+    if json_mode:
+        json_data["response_format"] = {"type": "json_object"}
     
     try:
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json=json_data,
-            timeout=30
-        )
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
-    except Exception as e:
+        response = await http_client.post(CHAT_COMPLETIONS_URL, headers=headers, json=json_data, provider="openai")
+    except httpx.HTTPError as e:
         print(f"Error querying GPT-4: {e}")
-        return f"Error: {str(e)}"
+        raise UpstreamError("openai", f"{type(e).__name__}: {e}") from e
+
+    if response.status_code != 200:
+        print(f"Error querying GPT-4: {response.status_code}, {response.text[:200]}")
+        raise UpstreamError(
+            "openai", f"chat completion failed with status {response.status_code}",
+            status_code=response.status_code, retry_after=retry_after_seconds(response),
+        )
+    try:
+        response_data = response.json()
+        return response_data["choices"][0]["message"]["content"], response_data.get("usage", {})
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        raise UpstreamError("openai", f"unexpected chat completion response: {e}") from e
+
+async def stream_gpt4_async(prompt: str) -> AsyncIterator[str]:
+    """Stream answer tokens from the chat-completions API as they are generated"""
+    if not Config.OPENAI_API_KEY:
+        raise ValueError("OPENAI_API_KEY environment variable is not set")
+
+    headers = {
+        "Authorization": f"Bearer {Config.OPENAI_API_KEY}",
+        "Content-Type": "application/json"
+    }
+    json_data = {
+        "model": Config.GPT_MODEL,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": Config.GPT_TEMPERATURE,
+        "max_tokens": Config.GPT_MAX_TOKENS,
+        "stream": True
+    }
+
+    with stage_span("llm_stream"):
+        async with http_client.stream("POST", CHAT_COMPLETIONS_URL, provider="openai", headers=headers, json=json_data) as response:
+            if response.status_code != 200:
+                body = await response.aread()
+                raise UpstreamError(
+                    "openai", f"streaming request failed: {response.status_code}, {body[:200]!r}",
+                    status_code=response.status_code, retry_after=retry_after_seconds(response),
+                )
+            # Server-sent events: one "data: {json}" line per delta, terminated by "data: [DONE]"
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or []
+                delta = choices[0].get("delta", {}).get("content") if choices else None
+                if delta:
+                    yield delta
 
 # --- Synchronous wrapper ---
 def query_gpt4(prompt: str) -> str:
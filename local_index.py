@@ -0,0 +1,190 @@
+import threading
+import numpy as np
+from typing import List, Dict, Any, Optional, Tuple, Sequence
+from vectors import stack
+
+class LocalVectorIndex:
+    """In-process cosine-similarity index backed by a NumPy matrix.
+
+    Small corpora are searched exactly with one matrix-vector product. Once the
+    index grows past `exact_max_vectors` it trains an IVF (inverted file) layout
+    with k-means centroids and only scans the `nprobe` closest lists per query.
+    """
+
+    def __init__(self, dimension: int, exact_max_vectors: int = 20000,
+                 nlist: int = 0, nprobe: int = 8, kmeans_iters: int = 10):
+        self.dimension = dimension
+        self.exact_max_vectors = exact_max_vectors
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.kmeans_iters = kmeans_iters
+
+        self._lock = threading.RLock()
+        self._matrix = np.zeros((0, dimension), dtype=np.float32)
+        self._size = 0
+        self._ids: List[str] = []
+        self._metadata: List[Dict[str, Any]] = []
+        self._positions: Dict[str, int] = {}
+
+        # IVF state (only populated in approximate mode)
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: List[List[int]] = []
+        self._trained_size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def is_approximate(self) -> bool:
+        return self._centroids is not None
+
+    def _ensure_capacity(self, needed: int):
+        capacity = self._matrix.shape[0]
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2, 64)
+        grown = np.zeros((new_capacity, self.dimension), dtype=np.float32)
+        grown[:self._size] = self._matrix[:self._size]
+        self._matrix = grown
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def upsert(self, vectors: Sequence[Tuple[str, Sequence[float], Dict[str, Any]]]) -> int:
+        """Insert or overwrite (id, values, metadata) tuples, same shape as Pinecone upserts"""
+        if not vectors:
+            return 0
+        values = stack([v[1] for v in vectors])
+        if values.ndim != 2 or values.shape[1] != self.dimension:
+            raise ValueError(f"Expected vectors of dimension {self.dimension}, got {values.shape}")
+        values = self._normalize(values)
+
+        with self._lock:
+            self._ensure_capacity(self._size + len(vectors))
+            for (vec_id, _, metadata), row in zip(vectors, values):
+                pos = self._positions.get(vec_id)
+                if pos is None:
+                    pos = self._size
+                    self._size += 1
+                    self._ids.append(vec_id)
+                    self._metadata.append(metadata or {})
+                    self._positions[vec_id] = pos
+                    self._matrix[pos] = row
+                    if self._centroids is not None:
+                        self._lists[self._nearest_centroid(row)].append(pos)
+                else:
+                    self._metadata[pos] = metadata or {}
+                    self._matrix[pos] = row
+                    if self._centroids is not None:
+                        # Moved vectors are reassigned on the next retrain
+                        self._trained_size = 0
+            self._maybe_train()
+        return len(vectors)
+
+    def delete(self, ids: Sequence[str]) -> int:
+        """Remove vectors by id, compacting the matrix"""
+        with self._lock:
+            drop = {self._positions[i] for i in ids if i in self._positions}
+            if not drop:
+                return 0
+            keep = [p for p in range(self._size) if p not in drop]
+            self._matrix = self._matrix[keep].copy() if keep else np.zeros((0, self.dimension), dtype=np.float32)
+            self._ids = [self._ids[p] for p in keep]
+            self._metadata = [self._metadata[p] for p in keep]
+            self._size = len(keep)
+            self._positions = {vec_id: pos for pos, vec_id in enumerate(self._ids)}
+            self._centroids = None
+            self._lists = []
+            self._trained_size = 0
+            self._maybe_train()
+            return len(drop)
+
+    def _nearest_centroid(self, row: np.ndarray) -> int:
+        return int(np.argmax(self._centroids @ row))
+
+    def _maybe_train(self):
+        """(Re)build IVF lists when the corpus crosses the exact threshold or doubles"""
+        if self._size <= self.exact_max_vectors:
+            self._centroids = None
+            self._lists = []
+            return
+        if self._centroids is not None and self._trained_size and self._size < 2 * self._trained_size:
+            return
+        self._train_ivf()
+
+    def _train_ivf(self):
+        data = self._matrix[:self._size]
+        nlist = self.nlist or max(1, int(np.sqrt(self._size)))
+        rng = np.random.default_rng(0)
+        sample_size = min(self._size, nlist * 64)
+        sample = data[rng.choice(self._size, size=sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, size=nlist, replace=False)].copy()
+
+        # Spherical k-means on the sample
+        for _ in range(self.kmeans_iters):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[assign == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = self._normalize(centroids)
+
+        assign = np.argmax(data @ centroids.T, axis=1)
+        self._lists = [[] for _ in range(nlist)]
+        for pos, c in enumerate(assign):
+            self._lists[int(c)].append(pos)
+        self._centroids = centroids
+        self._trained_size = self._size
+
+    def query(self, vector: Sequence[float], top_k: int = 10) -> List[Dict[str, Any]]:
+        """Return Pinecone-style matches: [{"id", "score", "metadata"}]"""
+        q = self._normalize(np.asarray(vector, dtype=np.float32))
+        with self._lock:
+            if self._size == 0:
+                return []
+            if self._centroids is None:
+                candidates = None
+                scores = self._matrix[:self._size] @ q
+            else:
+                nprobe = min(self.nprobe, len(self._lists))
+                probe = np.argpartition(-(self._centroids @ q), nprobe - 1)[:nprobe]
+                candidates = np.fromiter(
+                    (pos for c in probe for pos in self._lists[c]), dtype=np.int64
+                )
+                if candidates.size == 0:
+                    return []
+                scores = self._matrix[candidates] @ q
+
+            k = min(top_k, scores.shape[0])
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            matches = []
+            for i in top:
+                pos = int(candidates[i]) if candidates is not None else int(i)
+                matches.append({
+                    "id": self._ids[pos],
+                    "score": float(scores[i]),
+                    "metadata": self._metadata[pos],
+                })
+            return matches
+
+    def query_batch(self, vectors: Sequence[Sequence[float]], top_k: int = 10) -> List[List[Dict[str, Any]]]:
+        """Answer many queries at once; exact mode uses a single matrix-matrix product"""
+        queries = self._normalize(stack(vectors))
+        with self._lock:
+            if self._centroids is not None or self._size == 0:
+                return [self.query(q, top_k) for q in queries]
+            scores = queries @ self._matrix[:self._size].T  # (num_queries, size)
+            k = min(top_k, self._size)
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            results = []
+            for row, candidates in zip(scores, top):
+                ordered = candidates[np.argsort(-row[candidates])]
+                results.append([
+                    {"id": self._ids[pos], "score": float(row[pos]), "metadata": self._metadata[pos]}
+                    for pos in ordered
+                ])
+            return results
@@ -0,0 +1,60 @@
+import asyncio
+from collections import deque
+from typing import Any, Dict, Optional
+
+from config import Config
+
+class EventLoopLagMonitor:
+    """Measures how late a periodic sleep wakes up, i.e. how long the loop was blocked.
+
+    Keeps the last `window` samples for percentiles plus running maxima, and
+    logs every probe whose lag exceeds `warn_threshold` as a stall.
+    """
+
+    def __init__(self, interval: float = 0.25, warn_threshold: float = 0.1, window: int = 240):
+        self.interval = interval
+        self.warn_threshold = warn_threshold
+        self._samples: deque = deque(maxlen=window)
+        self._task: Optional[asyncio.Task] = None
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.probes = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.record(max(0.0, loop.time() - expected))
+
+    def record(self, lag: float):
+        self.probes += 1
+        self._samples.append(lag)
+        self.max_lag = max(self.max_lag, lag)
+        if lag > self.warn_threshold:
+            self.stalls += 1
+            print(f"⚠️ Event loop blocked for {lag * 1000:.0f} ms")
+
+    def stats(self) -> Dict[str, Any]:
+        samples = sorted(self._samples)
+        def percentile(p: float) -> float:
+            return samples[min(len(samples) - 1, int(p * len(samples)))] if samples else 0.0
+        return {
+            "last_lag_ms": round(self._samples[-1] * 1000, 2) if self._samples else 0.0,
+            "p50_lag_ms": round(percentile(0.50) * 1000, 2),
+            "p99_lag_ms": round(percentile(0.99) * 1000, 2),
+            "max_lag_ms": round(self.max_lag * 1000, 2),
+            "stalls": self.stalls,
+            "probes": self.probes,
+        }
+
+loop_monitor = EventLoopLagMonitor(Config.LOOP_LAG_INTERVAL, Config.LOOP_LAG_WARN_SECONDS)
@@ -0,0 +1,233 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from config import Config
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+# Set per request (see api.py) so spans and logs can be correlated
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# (labels, value) pairs of one metric family
+Samples = List[Tuple[Dict[str, str], float]]
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+class _Metric:
+    """A metric family with a fixed set of label names, in the Prometheus data model"""
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+
+    def labels(self, *values: Any) -> "_Child":
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+        return _Child(self, tuple(str(value) for value in values))
+
+    def _label_dict(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+class _Child:
+    """A metric bound to concrete label values"""
+
+    def __init__(self, metric: _Metric, key: Tuple[str, ...]):
+        self._metric = metric
+        self._key = key
+
+    def inc(self, amount: float = 1.0):
+        self._metric._inc(self._key, amount)
+
+    def dec(self, amount: float = 1.0):
+        self._metric._inc(self._key, -amount)
+
+    def set(self, value: float):
+        self._metric._set(self._key, value)
+
+    def observe(self, value: float):
+        self._metric._observe(self._key, value)
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _inc(self, key: Tuple[str, ...], amount: float):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def inc(self, amount: float = 1.0):
+        self._inc((), amount)
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, self._label_dict(key), value
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def _set(self, key: Tuple[str, ...], value: float):
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1.0):
+        self._inc((), -amount)
+
+    def set(self, value: float):
+        self._set((), value)
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def _observe(self, key: Tuple[str, ...], value: float):
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def observe(self, value: float):
+        self._observe((), value)
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        for key, (counts, total, count) in items:
+            labels = self._label_dict(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", dict(labels, le=_format_value(bound)), cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+class Registry:
+    """Metric families plus collectors that report other components' stats at scrape time"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, Samples]]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, Samples]]]):
+        """`collector()` yields (name, type, documentation, [(labels, value)]) per family"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for collector in self._collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+                continue
+            for name, metric_type, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+REQUESTS = registry.register(Counter(
+    "rag_http_requests_total", "HTTP requests by route and status code", ("route", "status")))
+REQUEST_DURATION = registry.register(Histogram(
+    "rag_http_request_duration_seconds", "Time until the response starts, by route", ("route",)))
+REQUESTS_IN_FLIGHT = registry.register(Gauge(
+    "rag_http_requests_in_flight", "HTTP requests currently being handled, by route", ("route",)))
+STAGE_DURATION = registry.register(Histogram(
+    "rag_stage_duration_seconds", "Pipeline stage duration (pdf, chunking, embedding, upsert, retrieval, rerank, llm, ...)", ("stage",)))
+STAGE_IN_FLIGHT = registry.register(Gauge(
+    "rag_stage_in_flight", "Pipeline stage calls currently running", ("stage",)))
+STAGE_ERRORS = registry.register(Counter(
+    "rag_stage_errors_total", "Pipeline stage calls that raised, by exception type", ("stage", "error")))
+UPSTREAM_ERRORS = registry.register(Counter(
+    "rag_upstream_errors_total", "Failed upstream calls by provider and kind (status code, transport, circuit_open)", ("provider", "kind")))
+
+_tracer = otel_trace.get_tracer("rag") if otel_trace is not None and Config.OTEL_TRACING else None
+
+@contextmanager
+def stage_span(stage: str, **attributes: Any):
+    """Time one pipeline stage call into the metrics and, with OpenTelemetry enabled, a span.
+
+    The span carries the current request id as `rag.request_id`.
+    """
+    if _tracer is not None:
+        request_id = request_id_var.get()
+        if request_id is not None:
+            attributes["rag.request_id"] = request_id
+        span_context = _tracer.start_as_current_span(f"rag.{stage}", attributes=attributes)
+    else:
+        span_context = nullcontext()
+
+    in_flight = STAGE_IN_FLIGHT.labels(stage)
+    in_flight.inc()
+    start = time.perf_counter()
+    try:
+        with span_context:
+            yield
+    except BaseException as e:
+        STAGE_ERRORS.labels(stage, type(e).__name__).inc()
+        raise
+    finally:
+        STAGE_DURATION.labels(stage).observe(time.perf_counter() - start)
+        in_flight.dec()
+
+def timed_stage(stage: str):
+    """Decorator form of stage_span for coroutine functions"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with stage_span(stage):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def observe_stage(stage: str, seconds: float):
+    """Record a stage duration measured elsewhere (e.g. busy time summed over a pipeline)"""
+    STAGE_DURATION.labels(stage).observe(seconds)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List
+from typing import Any, Dict, List, Optional
 
 class QARequest(BaseModel):
     documents: str
@@ -7,3 +7,28 @@ class QARequest(BaseModel):
 
 class QAResponse(BaseModel):
     answers: List[str]
+
+class QAStreamEvent(BaseModel):
+    type: str  # "answer", "token", "error" or "done"
+    index: Optional[int] = None
+    question: Optional[str] = None
+    answer: Optional[str] = None
+    delta: Optional[str] = None
+    error: Optional[str] = None
+    total_time: Optional[float] = None
+
+class IngestRequest(BaseModel):
+    documents: str
+    priority: str = "normal"  # "high", "normal" or "low"
+
+class IngestJob(BaseModel):
+    job_id: str
+    url: str
+    status: str  # "queued", "running", "done" or "failed"
+    priority: str
+    progress: Dict[str, Any]  # stage plus pages / chunks / embedded / stored / reused counts
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
@@ -0,0 +1,210 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import Config
+
+# Lower value wins: question-time calls are served before bulk ingestion calls
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+class UpstreamError(Exception):
+    """An upstream provider call failed (error status, transport error or unusable response)"""
+
+    def __init__(self, provider: str, message: str, status_code: Optional[int] = None,
+                 retry_after: Optional[float] = None):
+        super().__init__(f"{provider}: {message}")
+        self.provider = provider
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class CircuitOpenError(UpstreamError):
+    """Raised without calling the provider while its circuit breaker is open"""
+
+class AdaptiveRateLimiter:
+    """Token bucket with a priority wait queue whose rate adapts to throttling.
+
+    Every 429 halves the rate (down to `min_rate`) and, with a Retry-After
+    header, pauses the bucket for that long; each success adds back a small
+    step until `max_rate` is reached again (AIMD). Waiters are granted tokens
+    lowest priority value first, FIFO within a priority. Like HTTPClient, the
+    wait queue is tied to the running event loop.
+    """
+
+    def __init__(self, name: str, max_rate: float, min_rate: float = 0.5, burst_seconds: float = 1.0):
+        self.name = name
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.burst_seconds = burst_seconds
+        self.rate = max_rate
+        self._tokens = self._capacity()
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.granted = 0
+        self.throttled = 0
+        self.waited = 0.0
+
+    def _capacity(self) -> float:
+        return max(1.0, self.rate * self.burst_seconds)
+
+    def _refill(self, now: float):
+        self._tokens = min(self._capacity(), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._waiters = []
+            self._timer = None
+        return loop
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE):
+        """Wait for a token; waiters with a lower priority value are served first"""
+        loop = self._ensure_loop()
+        future = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        started = time.monotonic()
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just before the cancellation landed: return the token
+                self._tokens += 1
+            raise
+        self.waited += time.monotonic() - started
+
+    def _dispatch(self):
+        self._timer = None
+        now = time.monotonic()
+        self._refill(now)
+        while self._waiters and now >= self._paused_until and self._tokens >= 1:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue  # Cancelled while queued
+            self._tokens -= 1
+            self.granted += 1
+            future.set_result(None)
+        if self._waiters and self._timer is None:
+            delay = max(self._paused_until - now, (1 - self._tokens) / self.rate, 0.001)
+            self._timer = self._loop.call_later(delay, self._dispatch)
+
+    def on_success(self):
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def on_throttle(self, retry_after: Optional[float] = None):
+        self.throttled += 1
+        self.rate = max(self.min_rate, self.rate / 2)
+        self._tokens = min(self._tokens, 0.0)
+        if retry_after:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rate": round(self.rate, 3),
+            "max_rate": self.max_rate,
+            "queued": len(self._waiters),
+            "granted": self.granted,
+            "throttled": self.throttled,
+            "total_wait_seconds": round(self.waited, 3),
+        }
+
+class CircuitBreaker:
+    """Closed -> open after `failure_threshold` consecutive failures -> half-open after `reset_timeout`.
+
+    While open every call fails fast with CircuitOpenError; in half-open a
+    single trial call is let through and its outcome closes or re-opens the
+    circuit.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self.rejected = 0
+        self.trips = 0
+
+    def retry_after(self) -> float:
+        return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def before_call(self):
+        if self.state == "open":
+            if self.retry_after() > 0:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, "circuit open after repeated failures", retry_after=self.retry_after())
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._trial_in_flight:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, "circuit half-open, trial call in flight", retry_after=1.0)
+            self._trial_in_flight = True
+
+    def record_success(self):
+        self._failures = 0
+        self._trial_in_flight = False
+        self.state = "closed"
+
+    def release(self):
+        """The call ended without a verdict (e.g. cancelled): free the half-open trial slot"""
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self._failures += 1
+        self._trial_in_flight = False
+        if self.state == "half_open" or self._failures >= self.failure_threshold:
+            if self.state != "open":
+                self.trips += 1
+                print(f"Circuit for {self.name} opened after {self._failures} consecutive failures")
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
+
+_limiters: Dict[str, AdaptiveRateLimiter] = {}
+_breakers: Dict[str, CircuitBreaker] = {}
+
+def get_rate_limiter(provider: str) -> AdaptiveRateLimiter:
+    limiter = _limiters.get(provider)
+    if limiter is None:
+        limiter = _limiters[provider] = AdaptiveRateLimiter(
+            provider,
+            Config.UPSTREAM_RATE_LIMITS.get(provider, 10.0),
+            Config.UPSTREAM_MIN_RATE,
+            Config.UPSTREAM_BURST_SECONDS,
+        )
+    return limiter
+
+def get_circuit_breaker(provider: str) -> CircuitBreaker:
+    breaker = _breakers.get(provider)
+    if breaker is None:
+        breaker = _breakers[provider] = CircuitBreaker(
+            provider, Config.CIRCUIT_FAILURE_THRESHOLD, Config.CIRCUIT_RESET_TIMEOUT
+        )
+    return breaker
+
+def upstream_stats() -> Dict[str, Any]:
+    return {
+        provider: {
+            "rate_limiter": get_rate_limiter(provider).stats(),
+            "circuit": get_circuit_breaker(provider).stats(),
+        }
+        for provider in sorted(set(_limiters) | set(_breakers))
+    }
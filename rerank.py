@@ -0,0 +1,123 @@
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from bm25 import BM25Builder, tokenize
+from config import Config
+from executors import run_cpu
+from metrics import timed_stage
+
+class LexicalReranker:
+    """CPU-only rescoring: BM25 over each question's candidate pool plus a bigram bonus.
+
+    The pool-level BM25 rewards candidates containing the question's rarer
+    terms (clause numbers, amounts, defined terms); matching question
+    bigrams adds phrase evidence. A small prior keeps the retrieval order
+    between otherwise tied candidates.
+    """
+
+    def score_groups(self, questions: Sequence[str], candidate_lists: Sequence[Sequence[str]]) -> List[List[float]]:
+        all_scores = []
+        for question, candidates in zip(questions, candidate_lists):
+            if not candidates:
+                all_scores.append([])
+                continue
+            builder = BM25Builder()
+            for ordinal, text in enumerate(candidates):
+                builder.add(ordinal, text)
+            scores = np.zeros(len(candidates), dtype=np.float32)
+            for ordinal, score in builder.build().search(question, len(candidates)):
+                scores[ordinal] = score
+
+            q_tokens = tokenize(question)
+            q_bigrams = set(zip(q_tokens, q_tokens[1:]))
+            for ordinal, text in enumerate(candidates):
+                if q_bigrams:
+                    c_tokens = tokenize(text)
+                    scores[ordinal] += 0.5 * len(q_bigrams & set(zip(c_tokens, c_tokens[1:])))
+                scores[ordinal] += 0.01 / (ordinal + 1)
+            all_scores.append(scores.tolist())
+        return all_scores
+
+class ONNXCrossEncoderReranker:
+    """Cross-encoder (e.g. a quantized MiniLM ms-marco export) run with onnxruntime on CPU.
+
+    Every (question, candidate) pair of the request is tokenized and scored
+    in RERANK_BATCH_SIZE batches of one session, not one call per question.
+    """
+
+    def __init__(self, model_path: str, tokenizer_path: str, max_length: int = 256):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = Config.RERANK_THREADS
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+    def _score_pairs(self, pairs: List[tuple]) -> np.ndarray:
+        scores = []
+        for i in range(0, len(pairs), Config.RERANK_BATCH_SIZE):
+            encodings = self.tokenizer.encode_batch(pairs[i:i + Config.RERANK_BATCH_SIZE])
+            feed = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+                "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+            }
+            logits = self.session.run(None, {k: v for k, v in feed.items() if k in self.input_names})[0]
+            # Single-logit models may emit (batch,) or (batch, 1); two-class models score the last logit
+            scores.append(logits.reshape(len(encodings), -1)[:, -1])
+        return np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
+
+    def score_groups(self, questions: Sequence[str], candidate_lists: Sequence[Sequence[str]]) -> List[List[float]]:
+        pairs = [(question, text) for question, candidates in zip(questions, candidate_lists) for text in candidates]
+        flat = self._score_pairs(pairs).tolist()
+        all_scores, offset = [], 0
+        for candidates in candidate_lists:
+            all_scores.append(flat[offset:offset + len(candidates)])
+            offset += len(candidates)
+        return all_scores
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+def get_reranker():
+    """Return the configured reranker, or None when RERANKER is "none" """
+    global _reranker
+    if Config.RERANKER == "none":
+        return None
+    with _reranker_lock:
+        if _reranker is None:
+            if Config.RERANKER == "onnx":
+                _reranker = ONNXCrossEncoderReranker(
+                    Config.RERANK_MODEL_PATH, Config.RERANK_TOKENIZER_PATH, Config.RERANK_MAX_LENGTH
+                )
+            elif Config.RERANKER == "lexical":
+                _reranker = LexicalReranker()
+            else:
+                raise ValueError(f"Unknown RERANKER '{Config.RERANKER}', expected 'none', 'lexical' or 'onnx'")
+    return _reranker
+
+def _rerank_sync(questions: Sequence[str], candidate_lists: Sequence[List[Dict[str, Any]]],
+                 top_n: int) -> List[List[Dict[str, Any]]]:
+    reranker = get_reranker()
+    texts = [[chunk["text"] for chunk in candidates] for candidates in candidate_lists]
+    all_scores = reranker.score_groups(questions, texts)
+    reranked = []
+    for candidates, scores in zip(candidate_lists, all_scores):
+        order = sorted(range(len(candidates)), key=lambda i: scores[i], reverse=True)[:top_n]
+        reranked.append([candidates[i] for i in order])
+    return reranked
+
+@timed_stage("rerank")
+async def rerank_batch(questions: Sequence[str], candidate_lists: Sequence[List[Dict[str, Any]]],
+                       top_n: Optional[int] = None) -> List[List[Dict[str, Any]]]:
+    """Rescore every question's candidates in one off-loop call and keep the best `top_n` each"""
+    if top_n is None:
+        top_n = Config.RERANK_TOP_N
+    if Config.RERANKER == "none":
+        return [list(candidates)[:top_n] for candidates in candidate_lists]
+    return await run_cpu(_rerank_sync, list(questions), list(candidate_lists), top_n)
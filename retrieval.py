@@ -0,0 +1,78 @@
+from typing import Any, Dict, List, Optional, Sequence
+
+from bm25 import get_sparse_index
+from config import Config
+from executors import run_io
+from metrics import timed_stage
+from vector_store import retrieve_matches, retrieve_matches_batch
+from vectors import Vector
+
+def reciprocal_rank_fusion(ranked_lists: Sequence[Sequence[int]], k: int = 60) -> List[int]:
+    """Fuse rankings of chunk ordinals: score(d) = sum over lists of 1 / (k + rank)"""
+    scores: Dict[int, float] = {}
+    for ranking in ranked_lists:
+        for rank, ordinal in enumerate(ranking, start=1):
+            scores[ordinal] = scores.get(ordinal, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+def _fuse(question: str, dense_matches: List[Dict[str, Any]], namespace: str, top_k: int) -> List[Dict[str, Any]]:
+    """Combine dense matches with BM25 hits from the document's sparse index"""
+    sparse_index = get_sparse_index(namespace)
+    if sparse_index is None:
+        return [match["metadata"] for match in dense_matches[:top_k]]
+
+    metadata_by_ordinal = {}
+    dense_ranking = []
+    for match in dense_matches:
+        ordinal = match["metadata"].get("ordinal")
+        if ordinal is None:
+            continue
+        if ordinal < len(sparse_index):
+            # Repeated texts share one vector; rank it under the first occurrence, as BM25 does
+            ordinal = int(sparse_index.first_ordinals[ordinal])
+        if ordinal in metadata_by_ordinal:
+            continue
+        metadata_by_ordinal[ordinal] = match["metadata"]
+        dense_ranking.append(ordinal)
+
+    sparse_ranking = [ordinal for ordinal, _ in sparse_index.search(question, Config.HYBRID_CANDIDATES)]
+    fused = reciprocal_rank_fusion([dense_ranking, sparse_ranking], Config.RRF_K)[:top_k]
+    return [metadata_by_ordinal.get(ordinal) or sparse_index.chunk_metadata(ordinal) for ordinal in fused]
+
+def retrieve_context(question: str, query_emb: Optional[Vector], namespace: str, top_k: int = None) -> List[Dict[str, Any]]:
+    """Retrieve chunk metadata for one question, fusing dense and BM25 rankings when enabled"""
+    if top_k is None:
+        top_k = Config.TOP_K
+    if not Config.HYBRID_RETRIEVAL:
+        return [match["metadata"] for match in retrieve_matches(query_emb, top_k, namespace)]
+
+    dense_matches = retrieve_matches(query_emb, Config.HYBRID_CANDIDATES, namespace) if query_emb is not None else []
+    return _fuse(question, dense_matches, namespace, top_k)
+
+def retrieve_context_batch(questions: List[str], query_embs: List[Optional[Vector]], namespace: str,
+                           top_k: int = None) -> List[List[Dict[str, Any]]]:
+    """Batched retrieve_context: one multi-query dense call, then per-question fusion"""
+    if top_k is None:
+        top_k = Config.TOP_K
+    fetch_k = Config.HYBRID_CANDIDATES if Config.HYBRID_RETRIEVAL else top_k
+
+    embedded = [i for i, emb in enumerate(query_embs) if emb is not None]
+    dense: List[List[Dict[str, Any]]] = [[] for _ in questions]
+    for i, matches in zip(embedded, retrieve_matches_batch([query_embs[i] for i in embedded], fetch_k, namespace)):
+        dense[i] = matches
+
+    if not Config.HYBRID_RETRIEVAL:
+        return [[match["metadata"] for match in matches] for matches in dense]
+    return [_fuse(question, matches, namespace, top_k) for question, matches in zip(questions, dense)]
+
+@timed_stage("retrieval")
+async def retrieve_context_async(question: str, query_emb: Optional[Vector], namespace: str,
+                                 top_k: int = None) -> List[Dict[str, Any]]:
+    """retrieve_context on the I/O pool (Pinecone queries block; local search and BM25 are NumPy)"""
+    return await run_io(retrieve_context, question, query_emb, namespace, top_k)
+
+@timed_stage("retrieval")
+async def retrieve_context_batch_async(questions: List[str], query_embs: List[Optional[Vector]], namespace: str,
+                                       top_k: int = None) -> List[List[Dict[str, Any]]]:
+    """retrieve_context_batch on the I/O pool"""
+    return await run_io(retrieve_context_batch, questions, query_embs, namespace, top_k)
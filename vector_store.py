@@ -1,35 +1,170 @@
-import uuid
 import asyncio
-from typing import List, Optional, Tuple, Any
-from pinecone import Pinecone, ServerlessSpec
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple, Any, Dict, Union
+from cache import get_cache_key
 from config import Config
+from executors import run_io
+from metrics import timed_stage
+from document_processor import Chunk
+from vectors import Vector, to_provider
 
-# Initialize Pinecone
-if not Config.PINECONE_API_KEY:
-    raise ValueError("PINECONE_API_KEY environment variable is not set")
+# --- Backends ---
+class PineconeBackend:
+    """Pinecone serverless index, connected lazily on first use"""
+    shared = True  # Vectors survive restarts and are visible to every worker
 
-pc = Pinecone(api_key=Config.PINECONE_API_KEY)
+    def __init__(self):
+        self._index = None
 
-# Check if index exists and create if needed
-existing_indexes = [index_info['name'] for index_info in pc.list_indexes()]
-if Config.INDEX_NAME not in existing_indexes:
-    pc.create_index(
-        name=Config.INDEX_NAME,
-        dimension=Config.PINECONE_DIMENSION,
-        spec=ServerlessSpec(cloud=Config.PINECONE_CLOUD, region=Config.PINECONE_REGION)
-    )
+    @property
+    def index(self):
+        if self._index is None:
+            from pinecone import Pinecone, ServerlessSpec
 
-index = pc.Index(Config.INDEX_NAME)
+            if not Config.PINECONE_API_KEY:
+                raise ValueError("PINECONE_API_KEY environment variable is not set")
+
+            pc = Pinecone(api_key=Config.PINECONE_API_KEY)
+
+            # Check if index exists and create if needed (skippable: every worker does this on first use)
+            existing_indexes = [index_info['name'] for index_info in pc.list_indexes()] if Config.PINECONE_ENSURE_INDEX else [Config.INDEX_NAME]
+            if Config.INDEX_NAME not in existing_indexes:
+                pc.create_index(
+                    name=Config.INDEX_NAME,
+                    dimension=Config.PINECONE_DIMENSION,
+                    spec=ServerlessSpec(cloud=Config.PINECONE_CLOUD, region=Config.PINECONE_REGION)
+                )
+            self._index = pc.Index(Config.INDEX_NAME)
+        return self._index
+
+    def upsert(self, vectors: List[Tuple[str, Vector, Dict[str, Any]]], namespace: str = "") -> None:
+        # The Pinecone client wants plain lists; convert only at this boundary
+        vectors = [(vec_id, to_provider(values), metadata) for vec_id, values, metadata in vectors]
+        self.index.upsert(vectors, namespace=namespace)
+
+    def delete(self, ids: List[str], namespace: str = "") -> None:
+        self.index.delete(ids=ids, namespace=namespace)
+
+    def query(self, vector: Vector, top_k: int, namespace: str = "") -> List[Dict[str, Any]]:
+        results = self.index.query(vector=to_provider(vector), top_k=top_k, include_metadata=True, namespace=namespace)
+        return results["matches"]
+
+    def query_batch(self, vectors: List[Vector], top_k: int, namespace: str = "") -> List[List[Dict[str, Any]]]:
+        # Pinecone has no multi-vector query; issue the queries concurrently over the client's pool
+        with ThreadPoolExecutor(max_workers=min(len(vectors), Config.CONCURRENT_UPLOADS * 2) or 1) as pool:
+            return list(pool.map(lambda vector: self.query(vector, top_k, namespace), vectors))
+
+class LocalBackend:
+    """In-process NumPy indexes (exact for small corpora, IVF for large ones), one per namespace"""
+    shared = False  # Each worker process holds its own copy, lost on restart
+
+    def __init__(self):
+        self.namespaces = {}
+
+    def _get_index(self, namespace: str, create: bool):
+        index = self.namespaces.get(namespace)
+        if index is None and create:
+            from local_index import LocalVectorIndex
+
+            index = self.namespaces.setdefault(namespace, LocalVectorIndex(
+                dimension=Config.PINECONE_DIMENSION,
+                exact_max_vectors=Config.LOCAL_EXACT_MAX_VECTORS,
+                nlist=Config.LOCAL_IVF_NLIST,
+                nprobe=Config.LOCAL_IVF_NPROBE,
+            ))
+        return index
+
+    def upsert(self, vectors: List[Tuple[str, Vector, Dict[str, Any]]], namespace: str = "") -> None:
+        self._get_index(namespace, create=True).upsert(vectors)
+
+    def delete(self, ids: List[str], namespace: str = "") -> None:
+        index = self._get_index(namespace, create=False)
+        if index is not None:
+            index.delete(ids)
+
+    def query(self, vector: Vector, top_k: int, namespace: str = "") -> List[Dict[str, Any]]:
+        index = self._get_index(namespace, create=False)
+        return index.query(vector, top_k=top_k) if index is not None else []
+
+    def query_batch(self, vectors: List[Vector], top_k: int, namespace: str = "") -> List[List[Dict[str, Any]]]:
+        index = self._get_index(namespace, create=False)
+        return index.query_batch(vectors, top_k=top_k) if index is not None else [[] for _ in vectors]
+
+_BACKENDS = {
+    "pinecone": PineconeBackend,
+    "local": LocalBackend,
+}
+_backend = None
+
+def get_backend():
+    """Return the configured vector-store backend, creating it on first use"""
+    global _backend
+    if _backend is None:
+        backend_name = Config.VECTOR_BACKEND.lower()
+        if backend_name not in _BACKENDS:
+            raise ValueError(f"Unknown VECTOR_BACKEND '{Config.VECTOR_BACKEND}', expected one of {list(_BACKENDS)}")
+        _backend = _BACKENDS[backend_name]()
+        print(f"Vector store backend: {backend_name}")
+    return _backend
+
+def make_vector_id(namespace: str, chunk: Union[str, Chunk]) -> str:
+    """Deterministic id from the chunk text's hash: re-ingesting overwrites instead of duplicating,
+    and an unchanged chunk keeps its id when the surrounding document changes.
+
+    Chunks with identical text (a repeated header, a boilerplate clause)
+    therefore share one vector. Its metadata is always the first
+    occurrence's: store_chunks_async and the streaming pipeline only upsert
+    that one, set_namespace_chunks keeps it, and the BM25 index ranks the
+    text under the same ordinal (see BM25Index.first_ordinals).
+    """
+    text = chunk.text if isinstance(chunk, Chunk) else chunk
+    return chunk_vector_id(namespace, get_cache_key(text))
+
+def chunk_vector_id(namespace: str, chunk_key: str) -> str:
+    """Vector id from a chunk's text hash (its embedding-cache key)"""
+    return f"{namespace}-{chunk_key}"
+
+def chunk_metadata(chunk: Union[str, Chunk], ordinal: int) -> Dict[str, Any]:
+    """Metadata stored alongside each vector"""
+    if isinstance(chunk, Chunk):
+        return {
+            "text": chunk.text,
+            "ordinal": ordinal,
+            "page": chunk.page,
+            "page_end": chunk.page_end,
+            "start": chunk.start,
+            "end": chunk.end,
+        }
+    return {"text": chunk, "ordinal": ordinal}
+
+@timed_stage("upsert")
+async def store_chunks_async(chunks: List[Union[str, Chunk]], embeddings: List[Optional[Vector]], namespace: str = "",
+                             start_ordinal: int = 0, ordinals: Optional[Sequence[int]] = None) -> None:
+    """Async batch upsert with parallel processing into the document's namespace.
+
+    `start_ordinal` is the position of chunks[0] in the document, so a
+    document can be stored in several calls; `ordinals` gives explicit
+    positions for a non-contiguous selection of chunks instead (ascending).
+    Chunk objects also store their page numbers and char offsets as
+    metadata. A text repeated within the call is stored once, for its
+    first chunk with an embedding (see make_vector_id).
+    """
+    backend = get_backend()
 
-async def store_chunks_async(chunks: List[str], embeddings: List[Optional[List[float]]]) -> None:
-    """Async batch upsert with parallel processing"""
     # Filter out failed embeddings
     valid_vectors = []
     failed_count = 0
     
-    for chunk, emb in zip(chunks, embeddings):
+    if ordinals is None:
+        ordinals = range(start_ordinal, start_ordinal + len(chunks))
+    stored_ids = set()
+    for ordinal, chunk, emb in zip(ordinals, chunks, embeddings):
         if emb is not None and len(emb) > 0:
-            valid_vectors.append((str(uuid.uuid4()), emb, {"text": chunk}))
+            vector_id = make_vector_id(namespace, chunk)
+            if vector_id not in stored_ids:
+                stored_ids.add(vector_id)
+                valid_vectors.append((vector_id, emb, chunk_metadata(chunk, ordinal)))
         else:
             failed_count += 1
     
@@ -42,9 +177,8 @@ async def store_chunks_async(chunks: List[str], embeddings: List[Optional[List[f
     async def upsert_batch(batch_vectors):
         """Upsert a single batch"""
         try:
-            # Run Pinecone upsert in thread pool to avoid blocking
-            loop = asyncio.get_event_loop()
-            await loop.run_in_executor(None, lambda: index.upsert(batch_vectors))
+            # Run upsert on the I/O pool to avoid blocking
+            await run_io(backend.upsert, batch_vectors, namespace)
         except Exception as e:
             print(f"Error upserting batch: {e}")
             raise
@@ -62,15 +196,70 @@ async def store_chunks_async(chunks: List[str], embeddings: List[Optional[List[f
     # Upload all batches in parallel
     await asyncio.gather(*[upload_with_semaphore(batch) for batch in batches])
 
-def retrieve_chunks(query_emb: List[float], top_k: int = None) -> List[str]:
-    """Search in Pinecone and retrieve relevant chunks"""
+@timed_stage("delete")
+async def delete_vectors_async(ids: List[str], namespace: str = "") -> None:
+    """Delete vectors by id in DELETE_BATCH_SIZE batches, CONCURRENT_UPLOADS at a time"""
+    backend = get_backend()
+    semaphore = asyncio.Semaphore(Config.CONCURRENT_UPLOADS)
+
+    async def delete_batch(batch):
+        async with semaphore:
+            await run_io(backend.delete, batch, namespace)
+
+    await asyncio.gather(*[
+        delete_batch(ids[i:i + Config.DELETE_BATCH_SIZE]) for i in range(0, len(ids), Config.DELETE_BATCH_SIZE)
+    ])
+
+# --- Current chunk metadata of incrementally updated namespaces ---
+# Vectors of chunks that survived an update keep the metadata (ordinal, offsets,
+# pages) of the version they were stored with; matches are re-labelled from here.
+_current_chunks: Dict[str, Dict[str, Dict[str, Any]]] = {}
+_chunks_lock = threading.Lock()
+
+def set_namespace_chunks(namespace: str, chunks: Sequence[Chunk]):
+    """Record the chunk set a namespace now holds; matches for any other chunk are dropped.
+    A repeated text's vector is labelled with its first occurrence (see make_vector_id)."""
+    current = {}
+    for ordinal, chunk in enumerate(chunks):
+        current.setdefault(make_vector_id(namespace, chunk), chunk_metadata(chunk, ordinal))
+    with _chunks_lock:
+        _current_chunks[namespace] = current
+
+def _current_matches(matches: List[Dict[str, Any]], namespace: str) -> List[Dict[str, Any]]:
+    current = _current_chunks.get(namespace)
+    if current is None:
+        return matches
+    return [
+        {"id": match["id"], "score": match["score"], "metadata": current[match["id"]]}
+        for match in matches if match["id"] in current
+    ]
+
+def retrieve_matches(query_emb: Vector, top_k: int = None, namespace: str = "") -> List[Dict[str, Any]]:
+    """Search one document's namespace and return matches with their metadata"""
     if top_k is None:
         top_k = Config.TOP_K
     
-    results = index.query(vector=query_emb, top_k=top_k, include_metadata=True)
-    return [match["metadata"]["text"] for match in results["matches"]]
+    return _current_matches(get_backend().query(query_emb, top_k, namespace), namespace)
+
+def retrieve_chunks(query_emb: Vector, top_k: int = None, namespace: str = "") -> List[str]:
+    """Search one document's namespace and retrieve relevant chunks"""
+    return [match["metadata"]["text"] for match in retrieve_matches(query_emb, top_k, namespace)]
+
+def retrieve_matches_batch(query_embs: List[Vector], top_k: int = None, namespace: str = "") -> List[List[Dict[str, Any]]]:
+    """Retrieve matches for many questions in one call (one matrix product on the local backend)"""
+    if top_k is None:
+        top_k = Config.TOP_K
+    if not query_embs:
+        return []
+
+    return [_current_matches(matches, namespace) for matches in get_backend().query_batch(query_embs, top_k, namespace)]
+
+def retrieve_chunks_batch(query_embs: List[Vector], top_k: int = None, namespace: str = "") -> List[List[str]]:
+    """Retrieve chunks for many questions in one call"""
+    results = retrieve_matches_batch(query_embs, top_k, namespace)
+    return [[match["metadata"]["text"] for match in matches] for matches in results]
 
 # --- Synchronous wrapper for backward compatibility ---
-def store_chunks(chunks: List[str], embeddings: List[Optional[List[float]]]) -> None:
+def store_chunks(chunks: List[str], embeddings: List[Optional[Vector]], namespace: str = "") -> None:
     """Synchronous wrapper for async storage"""
-    return asyncio.run(store_chunks_async(chunks, embeddings))
+    return asyncio.run(store_chunks_async(chunks, embeddings, namespace))
@@ -0,0 +1,88 @@
+from typing import Any, NamedTuple, Optional, Sequence, Union
+
+import numpy as np
+
+# Embeddings travel through the service as 1-D float32 arrays (often row views
+# of one batch matrix). Python float lists only exist at the provider boundary.
+Vector = np.ndarray
+
+class QuantizedVector(NamedTuple):
+    """int8 scalar-quantized vector: values ~= codes * scale (symmetric, per vector)"""
+    codes: np.ndarray  # int8
+    scale: float
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + 4
+
+    def to_float32(self) -> Vector:
+        return self.codes.astype(np.float32) * np.float32(self.scale)
+
+CompactVector = Union[Vector, QuantizedVector]
+
+def as_vector(values: Any) -> Vector:
+    """View `values` as a float32 vector; no copy when it already is one"""
+    return np.asarray(values, dtype=np.float32)
+
+def from_provider(values: Sequence[float]) -> Vector:
+    """Convert one provider JSON embedding (a list of floats) into a float32 vector"""
+    return np.fromiter(values, dtype=np.float32, count=len(values))
+
+def batch_from_provider(rows: Sequence[Optional[Sequence[float]]]) -> list:
+    """Convert a provider batch into row views of one contiguous float32 matrix.
+
+    Missing rows stay None. All present rows must share one dimension.
+    """
+    present = [i for i, row in enumerate(rows) if row]
+    result: list = [None] * len(rows)
+    if not present:
+        return result
+    matrix = np.array([rows[i] for i in present], dtype=np.float32)
+    for i, row in zip(present, matrix):
+        result[i] = row
+    return result
+
+def to_provider(vector: Any) -> list:
+    """Plain float list for clients that need JSON-serialisable values (e.g. Pinecone)"""
+    return np.asarray(vector, dtype=np.float32).tolist()
+
+def stack(vectors: Sequence[Any]) -> np.ndarray:
+    """(n, dim) float32 matrix for batched similarity math"""
+    if isinstance(vectors, np.ndarray) and vectors.ndim == 2:
+        return vectors.astype(np.float32, copy=False)
+    return np.stack([as_vector(v) for v in vectors]) if len(vectors) else np.zeros((0, 0), dtype=np.float32)
+
+def quantize_int8(vector: Any) -> QuantizedVector:
+    vector = as_vector(vector)
+    peak = float(np.abs(vector).max()) if vector.size else 0.0
+    scale = peak / 127.0 if peak else 1.0
+    codes = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+    return QuantizedVector(codes, scale)
+
+def compact(vector: Any, dtype: str = "float32") -> CompactVector:
+    """Owned compact copy for long-lived storage ("float32" or "int8")"""
+    if dtype == "int8":
+        return quantize_int8(vector)
+    if dtype != "float32":
+        raise ValueError(f"Unknown vector dtype '{dtype}', expected 'float32' or 'int8'")
+    vector = as_vector(vector)
+    # A row view would keep its whole batch matrix alive
+    return vector.copy() if vector.base is not None else vector
+
+def expand(vector: CompactVector) -> Vector:
+    return vector.to_float32() if isinstance(vector, QuantizedVector) else vector
+
+def encode(vector: CompactVector) -> bytes:
+    """Blob form: raw float32 bytes, or a float32 scale followed by the int8 codes"""
+    if isinstance(vector, QuantizedVector):
+        return np.float32(vector.scale).tobytes() + vector.codes.tobytes()
+    return as_vector(vector).tobytes()
+
+def decode(blob: bytes, dim: int) -> CompactVector:
+    """Inverse of encode; the format follows from the blob length (4*dim vs dim + 4)"""
+    if len(blob) == 4 * dim:
+        return np.frombuffer(blob, dtype=np.float32)
+    if len(blob) == dim + 4:
+        scale = float(np.frombuffer(blob, dtype=np.float32, count=1)[0])
+        return QuantizedVector(np.frombuffer(blob, dtype=np.int8, offset=4), scale)
+    raise ValueError(f"Vector blob of {len(blob)} bytes does not match dimension {dim}")